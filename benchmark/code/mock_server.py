@@ -0,0 +1,223 @@
+import argparse
+import json
+import re
+import time
+import random
+import hashlib
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Rough prompt cost of one frame, matching the judge's own estimate
+IMAGE_TOKEN_ESTIMATE = 765
+# Providers cache prompt prefixes in blocks of this many tokens
+CACHE_BLOCK_TOKENS = 128
+
+def parse_latency(spec):
+    """Build a latency sampler (seconds) from 'fixed:S', 'uniform:A,B' or 'lognormal:MEDIAN,SIGMA'"""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",")] if params else []
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda: median * random.lognormvariate(0, sigma)
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+def count_tokens(text):
+    return max(len(text) // 4, 1)
+
+class MockState:
+    """Configuration and counters shared by all request handler threads"""
+    def __init__(self, latency="lognormal:1.5,0.4", rate_429=0.0, rate_5xx=0.0, retry_after=1.0, seed=None):
+        self.sample_latency = parse_latency(latency)
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.prefix_cache = OrderedDict()
+        self.stats = {"requests": 0, "ok": 0, "429": 0, "5xx": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.stats[key] += value
+
+    def draw_error(self):
+        with self.lock:
+            roll = self.random.random()
+        if roll < self.rate_429:
+            return 429
+        if roll < self.rate_429 + self.rate_5xx:
+            return 503
+        return None
+
+    def cached_prefix_tokens(self, prefix_key, prefix_tokens):
+        """Simulate provider prompt caching: a repeated prefix is served from cache in whole blocks"""
+        with self.lock:
+            hit = prefix_key in self.prefix_cache
+            self.prefix_cache[prefix_key] = True
+            self.prefix_cache.move_to_end(prefix_key)
+            while len(self.prefix_cache) > 10000:
+                self.prefix_cache.popitem(last=False)
+        if not hit:
+            return 0
+        return prefix_tokens // CACHE_BLOCK_TOKENS * CACHE_BLOCK_TOKENS
+
+def judge_reply(texts):
+    """One <score> block per packed prediction, with one rating per predicted step"""
+    prediction_text = next((text for text in reversed(texts) if "Model prediction:" in text), texts[-1])
+    prediction_text = prediction_text.split("Model prediction:", 1)[-1]
+    predictions = re.split(r"Prediction \d+: ", prediction_text)[1:] or [prediction_text]
+    blocks = []
+    for prediction in predictions:
+        steps = max(len(re.findall(r"Step \d+", prediction)), 1)
+        ratings = ", ".join(f"Step {i}: {1 if i % 3 else 0}/1" for i in range(1, steps + 1))
+        blocks.append(f"<score>{ratings}</score>")
+    if len(blocks) == 1:
+        return blocks[0]
+    return " ".join(f"Prediction {i}: {block}" for i, block in enumerate(blocks, 1))
+
+def extract_reply(text):
+    """A short reasoning chain ending in the label the answer mentions last"""
+    answer = re.search(r"answer: '(.*?)'\n", text, re.S)
+    words = re.findall(r"[A-Za-z]+", answer.group(1)) if answer else []
+    label = words[-1].lower() if words else "neutral"
+    if len(words) <= 3:
+        return f"<step>Step 1: The predicted emotion is {label}.</step>"
+    return (f"<step>Step 1: Observe the facial expressions of the person. "
+            f"Step 2: Consider the tone of voice. "
+            f"Step 3: Based on the analysis, determine that the predicted emotion is {label}.</step>")
+
+def build_completion(body, state):
+    messages = body.get("messages", [])
+    texts = []
+    # Message parts in order, with images replaced by their hash, to identify the cacheable prefix
+    parts = []
+    image_positions = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        for part in content or []:
+            if part.get("type") == "text":
+                texts.append(part["text"])
+                parts.append(part["text"])
+            else:
+                image_positions.append(len(parts))
+                parts.append(hashlib.sha256(part["image_url"]["url"].encode("utf-8")).hexdigest())
+
+    full_text = "".join(texts)
+    if "<score>" in full_text:
+        reply = judge_reply(texts)
+    else:
+        reply = extract_reply(full_text)
+
+    images = len(image_positions)
+    prompt_tokens = count_tokens(full_text) + IMAGE_TOKEN_ESTIMATE * images
+    # The cacheable prefix runs through the last image, or all but the final part for text-only requests
+    prefix_end = image_positions[-1] + 1 if image_positions else len(parts) - 1
+    prefix = parts[:prefix_end]
+    prefix_tokens = IMAGE_TOKEN_ESTIMATE * images + sum(
+        count_tokens(part) for i, part in enumerate(prefix) if i not in image_positions
+    )
+    prefix_key = hashlib.sha256("".join(prefix).encode("utf-8")).hexdigest()
+    cached_tokens = state.cached_prefix_tokens(prefix_key, prefix_tokens) if prefix_tokens >= 1024 else 0
+    completion_tokens = count_tokens(reply)
+    state.count("prompt_tokens", prompt_tokens)
+    state.count("cached_tokens", cached_tokens)
+
+    return {
+        "id": f"chatcmpl-mock-{random.getrandbits(48):012x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": reply},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens}
+        }
+    }
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            with self.state.lock:
+                stats = dict(self.state.stats)
+            self.send_json(200, stats)
+        else:
+            self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        self.state.count("requests")
+        time.sleep(self.state.sample_latency())
+
+        status = self.state.draw_error()
+        if status == 429:
+            self.state.count("429")
+            self.send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                           {"Retry-After": f"{self.state.retry_after:g}"})
+            return
+        if status is not None:
+            self.state.count("5xx")
+            self.send_json(status, {"error": {"message": "The server is overloaded", "type": "server_error"}})
+            return
+
+        self.state.count("ok")
+        self.send_json(200, build_completion(body, self.state))
+
+def start_server(state, host="127.0.0.1", port=0):
+    """Serve in a background thread; returns the server (its base URL is http://host:server.server_port)"""
+    handler = type("BoundMockHandler", (MockHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible /chat/completions stand-in for the judge and extractor")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Bind address")
+    parser.add_argument("--port", type=int, default=8000, help="Bind port")
+    parser.add_argument("--latency", type=str, default="lognormal:1.5,0.4",
+                        help="Latency distribution: fixed:S, uniform:A,B or lognormal:MEDIAN,SIGMA (seconds)")
+    parser.add_argument("--rate_429", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--rate_5xx", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--retry_after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for error injection")
+
+    args = parser.parse_args()
+
+    state = MockState(args.latency, args.rate_429, args.rate_5xx, args.retry_after, args.seed)
+    server = start_server(state, args.host, args.port)
+    print(f"Mock server listening on http://{args.host}:{server.server_port} (POST */chat/completions, GET /stats)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
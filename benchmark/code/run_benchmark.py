@@ -0,0 +1,198 @@
+import os
+import json
+import math
+import time
+import argparse
+import tempfile
+import threading
+import importlib.util
+from urllib.request import urlopen
+
+import numpy as np
+import cv2
+
+from mock_server import MockState, start_server
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+SHORT_ANSWERS = ["happy", "neutral", "sad", "angry", "surprise"]
+LONG_ANSWER = ("In the video, a woman sits in a bright office and speaks quickly. Her eyebrows are raised and "
+               "the corners of her mouth turn upward while her voice gets louder. Overall, she appears {label}.")
+
+def load_script(path, name):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def percentile(values, q):
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(math.ceil(q / 100 * len(ordered)) - 1, 0))]
+
+def timed(func, latencies, lock):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with lock:
+                latencies.append(time.perf_counter() - start)
+    return wrapper
+
+def server_stats(base_url):
+    with urlopen(f"{base_url}/stats") as response:
+        return json.loads(response.read())
+
+def write_video(path, seed, frames=48, fps=8, size=96):
+    """A short synthetic clip; written to a .mp4 name first because OpenCV picks the container from it"""
+    rng = np.random.default_rng(seed)
+    tmp_path = f"{path}.tmp.mp4"
+    writer = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (size, size))
+    base = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    for i in range(frames):
+        writer.write(np.roll(base, i * 2, axis=1))
+    writer.release()
+    os.replace(tmp_path, path)
+
+def make_inputs(work_dir, num_items):
+    entries = []
+    audio = []
+    for i in range(num_items):
+        video_id = f"bench_{i:05d}"
+        label = SHORT_ANSWERS[i % len(SHORT_ANSWERS)]
+        # Alternate bare labels and reasoning chains, like the real model responses
+        answer = label if i % 2 else LONG_ANSWER.format(label=label)
+        entries.append({"video_id": video_id, "model_response": answer, "ground_truth": label})
+        audio.append({"video_id": video_id, "audio_clue": "The speaker's voice is loud and fast."})
+
+    input_json = os.path.join(work_dir, "responses.json")
+    audio_json = os.path.join(work_dir, "audio.json")
+    with open(input_json, 'w') as f:
+        json.dump(entries, f)
+    with open(audio_json, 'w') as f:
+        json.dump(audio, f)
+    return input_json, audio_json, [entry["video_id"] for entry in entries]
+
+def run_stage(name, base_url, items, run):
+    """Run one stage and summarize throughput, latency and retry overhead from the mock server counters"""
+    latencies = []
+    lock = threading.Lock()
+    before = server_stats(base_url)
+    start = time.perf_counter()
+    run(latencies, lock)
+    wall = time.perf_counter() - start
+    after = server_stats(base_url)
+    delta = {key: after[key] - before[key] for key in after}
+    return {
+        "stage": name,
+        "items": items,
+        "wall_s": wall,
+        "items_per_s": items / wall if wall else 0.0,
+        "p50_s": percentile(latencies, 50),
+        "p95_s": percentile(latencies, 95),
+        "p99_s": percentile(latencies, 99),
+        "requests": delta["requests"],
+        "errors_429": delta["429"],
+        "errors_5xx": delta["5xx"],
+        "retry_overhead": (delta["requests"] - delta["ok"]) / max(delta["ok"], 1),
+        "cached_tokens": delta["cached_tokens"],
+        "prompt_tokens": delta["prompt_tokens"]
+    }
+
+def print_report(rows):
+    print("\n=== Benchmark Report ===")
+    header = f"{'stage':<10}{'items':>7}{'wall s':>9}{'items/s':>9}{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}" \
+             f"{'reqs':>7}{'429':>6}{'5xx':>6}{'retry%':>8}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['stage']:<10}{row['items']:>7}{row['wall_s']:>9.2f}{row['items_per_s']:>9.2f}"
+              f"{row['p50_s']:>8.2f}{row['p95_s']:>8.2f}{row['p99_s']:>8.2f}{row['requests']:>7}"
+              f"{row['errors_429']:>6}{row['errors_5xx']:>6}{100 * row['retry_overhead']:>8.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end throughput benchmark against the local mock judge server")
+    parser.add_argument("--task", type=str, default="ER-Lab", help="Task whose extract/judge scripts are benchmarked")
+    parser.add_argument("--stages", type=str, nargs="+", default=["extract", "judge"], choices=["extract", "judge"])
+    parser.add_argument("--num_items", type=int, default=200, help="Number of synthetic clips/responses")
+    parser.add_argument("--concurrency", type=int, default=16, help="Workers for extraction and judging")
+    parser.add_argument("--latency", type=str, default="lognormal:1.0,0.4", help="Mock latency distribution")
+    parser.add_argument("--rate_429", type=float, default=0.0, help="Fraction of mock requests answered with 429")
+    parser.add_argument("--rate_5xx", type=float, default=0.0, help="Fraction of mock requests answered with 503")
+    parser.add_argument("--retry_after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for error injection")
+    parser.add_argument("--work_dir", type=str, default="", help="Scratch directory (default: a temporary one)")
+    parser.add_argument("--report_json", type=str, default="", help="Also write the report rows to this file")
+
+    args = parser.parse_args()
+
+    state = MockState(args.latency, args.rate_429, args.rate_5xx, args.retry_after, args.seed)
+    server = start_server(state)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="mme_emotion_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    input_json, audio_json, video_ids = make_inputs(work_dir, args.num_items)
+    step_json = os.path.join(work_dir, "steps.json")
+    eval_json = os.path.join(work_dir, "eval.json")
+
+    rows = []
+    if "extract" in args.stages:
+        extract_step = load_script(os.path.join(REPO_ROOT, "extract_step", args.task, "code", "extract_step.py"),
+                                   "extract_step_bench")
+        # A reused --work_dir keeps the last run's extraction checkpoint, which the extractor refuses to overwrite
+        for path in (step_json, f"{step_json}.ckpt.jsonl"):
+            if os.path.exists(path):
+                os.remove(path)
+
+        def run_extract(latencies, lock):
+            extract_step.process_entry = timed(extract_step.process_entry, latencies, lock)
+            # Every synthetic entry is sent to the extractor, rule-based answers and dedup would hide its throughput
+            extract_step.process_json_file(input_json, step_json, "mock-extractor", "mock-key", f"{base_url}/v1",
+                                           workers=args.concurrency, rules=False, dedup=False)
+
+        rows.append(run_stage("extract", base_url, args.num_items, run_extract))
+    else:
+        # Judge-only runs use label-style steps
+        with open(input_json, 'r') as f:
+            entries = json.load(f)
+        for entry in entries:
+            entry["step"] = f"<step>Step 1: The predicted emotion is {entry['ground_truth']}.</step>"
+        with open(step_json, 'w') as f:
+            json.dump(entries, f)
+
+    if "judge" in args.stages:
+        judge = load_script(os.path.join(REPO_ROOT, "eval_cot", args.task, "code", "eval_cot_gpt4o.py"),
+                            "eval_cot_bench")
+        video_dir = os.path.join(work_dir, "videos")
+        os.makedirs(video_dir, exist_ok=True)
+        pipeline = judge.EvaluationPipeline(
+            video_dir,
+            concurrency=args.concurrency,
+            judge_url=f"{base_url}/v1/chat/completions"
+        )
+        for i, video_id in enumerate(video_ids):
+            write_video(pipeline.analyzer.video_path(video_id), seed=i)
+
+        # A reused --work_dir keeps the last run's judge checkpoint, which the judge refuses to overwrite
+        for path in (eval_json, f"{eval_json}.ckpt.jsonl"):
+            if os.path.exists(path):
+                os.remove(path)
+
+        def run_judge(latencies, lock):
+            analyzer = pipeline.analyzer
+            analyzer.analyze_predictions = timed(analyzer.analyze_predictions, latencies, lock)
+            pipeline.process_dataset(audio_json, step_json, eval_json)
+
+        rows.append(run_stage("judge", base_url, args.num_items, run_judge))
+        pipeline.http_session.close()
+
+    server.shutdown()
+    print_report(rows)
+    if args.report_json:
+        with open(args.report_json, 'w') as f:
+            json.dump(rows, f, indent=2)
+    print(f"\nScratch files kept in: {work_dir}")
@@ -1,49 +1,659 @@
 import os
 import json
+import math
 import re
 import base64
 import argparse
 import time
+import hashlib
+import threading
+import sqlite3
+import random
+from email.utils import parsedate_to_datetime
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import timedelta
 from tqdm import tqdm
 from openai import OpenAI
 import cv2
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov", ".webm", ".flv")
+
+# Motion sampling scans the clip at this many points per budgeted frame, as small grayscale thumbnails
+MOTION_SCAN_FACTOR = 8
+MOTION_THUMBNAIL_SIZE = (64, 64)
+# Mean absolute gray-level change (0-255) below which a pick repeats the previous one and is dropped
+MOTION_MIN_CHANGE = 2.0
+
+class FrameCache:
+    """Content-addressed on-disk cache of encoded key frames with LRU size-based eviction
+
+    The cache directory can be shared by several runs; total_bytes only counts the entries found
+    at startup and this process's own writes and evictions, so each run enforces max_bytes on
+    its own view of the directory.
+    """
+    def __init__(self, cache_dir, max_bytes=20 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self._stat_entries())
+
+    def _stat_entries(self):
+        """(path, size, mtime) of each entry, skipping entries another run removes meanwhile"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def key(self, video_path, **sampling):
+        """Identify a video by path, size and mtime together with the sampling parameters"""
+        stat = os.stat(video_path)
+        ident = json.dumps([os.path.realpath(video_path), stat.st_size, stat.st_mtime_ns, sampling], sort_keys=True)
+        return hashlib.sha256(ident.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                frames = json.load(f)
+            # Touch the entry so eviction drops the least recently used frames first
+            os.utime(path)
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return frames
+
+    def put(self, key, frames):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(frames, f)
+        size = os.path.getsize(tmp_path)
+        with self.lock:
+            if os.path.exists(path):
+                self.total_bytes -= os.path.getsize(path)
+            os.replace(tmp_path, path)
+            self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Remove least recently used entries until the cache is back under 90% of its budget"""
+        target = self.max_bytes * 0.9
+        for path, size, _ in sorted(self._stat_entries(), key=lambda entry: entry[2]):
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.total_bytes -= size
+
+class ResponseCache:
+    """SQLite (WAL) cache of judge responses keyed by a hash of the request payload"""
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.hits = 0
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, content TEXT NOT NULL, "
+            "input_tokens INTEGER, output_tokens INTEGER, created REAL)"
+        )
+        conn.commit()
+
+    def _connect(self):
+        # sqlite3 connections cannot be shared across threads, so each worker opens its own
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(payload):
+        """Hash the judge model id, rendered prompt text and frame hashes of a payload"""
+        messages = []
+        for message in payload["messages"]:
+            content = message["content"]
+            if isinstance(content, list):
+                content = [
+                    part["text"] if part["type"] == "text"
+                    else hashlib.sha256(part["image_url"]["url"].encode("utf-8")).hexdigest()
+                    for part in content
+                ]
+            messages.append([message["role"], content])
+        ident = json.dumps([payload["model"], payload.get("temperature"), messages], ensure_ascii=False)
+        return hashlib.sha256(ident.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        row = self._connect().execute(
+            "SELECT content, input_tokens, output_tokens FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            with self.lock:
+                self.hits += 1
+        return row
+
+    def put(self, key, content, input_tokens, output_tokens):
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+            (key, content, input_tokens, output_tokens, time.time())
+        )
+        conn.commit()
+
+class JudgeSession:
+    """Keep-alive HTTP session shared by every judge request of a run"""
+    def __init__(self, pool_size=1):
+        self.session = requests.Session()
+        # Block instead of opening throwaway connections once pool_size requests are in flight
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def post(self, url, **kwargs):
+        return self.session.post(url, **kwargs)
+
+    def stats(self):
+        """Requests sent versus TCP/TLS connections opened across all pooled hosts"""
+        pools = self.adapter.poolmanager.pools
+        num_requests = 0
+        num_connections = 0
+        for key in pools.keys():
+            pool = pools[key]
+            num_requests += pool.num_requests
+            num_connections += pool.num_connections
+        return {
+            "requests": num_requests,
+            "connections": num_connections,
+            "reused": num_requests - num_connections
+        }
+
+    def close(self):
+        self.session.close()
+
+# Rough prompt cost of one frame, used to reserve tokens before the provider reports usage
+IMAGE_TOKEN_ESTIMATE = 765
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute token buckets shared by all workers (0 = unlimited)"""
+    def __init__(self, rpm=0, tpm=0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.lock = threading.Lock()
+        self.request_allowance = float(rpm)
+        self.token_allowance = float(tpm)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        if self.rpm:
+            self.request_allowance = min(self.rpm, self.request_allowance + elapsed * self.rpm / 60)
+        if self.tpm:
+            self.token_allowance = min(self.tpm, self.token_allowance + elapsed * self.tpm / 60)
+
+    def acquire(self, tokens=0):
+        """Block until one request and `tokens` tokens fit in the budgets"""
+        tokens = min(tokens, self.tpm)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait_time = self.blocked_until - now
+                if wait_time <= 0:
+                    waits = [0.0]
+                    if self.rpm and self.request_allowance < 1:
+                        waits.append((1 - self.request_allowance) * 60 / self.rpm)
+                    if self.tpm and self.token_allowance < tokens:
+                        waits.append((tokens - self.token_allowance) * 60 / self.tpm)
+                    wait_time = max(waits)
+                    if wait_time == 0:
+                        if self.rpm:
+                            self.request_allowance -= 1
+                        if self.tpm:
+                            self.token_allowance -= tokens
+                        return
+            time.sleep(wait_time)
+
+    def record_usage(self, reserved_tokens, used_tokens):
+        """Settle a reservation against the usage the provider actually reported"""
+        if self.tpm:
+            with self.lock:
+                self.token_allowance += min(reserved_tokens, self.tpm) - used_tokens
+
+    def pause(self, seconds):
+        """Hold back every worker, e.g. when the provider sends Retry-After"""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+def parse_retry_after(response):
+    """Seconds requested by a Retry-After header (delta-seconds or HTTP-date), or None"""
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, base_delay, max_delay=60):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+# Stages of a judge call, in pipeline order, as reported in the Analysis Report and --timings_json
+TIMING_STAGES = ("frame_cache", "decode", "motion_select", "jpeg_encode", "base64", "cache_lookup", "serialize",
+                 "rate_limit", "network", "parse", "retry_sleep")
+
+@contextmanager
+def timed_stage(timings, stage):
+    """Add the wall time spent in the block to timings[stage] (no-op if timings is None)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[min(max(math.ceil(q / 100 * len(ordered)) - 1, 0), len(ordered) - 1)]
+
+def select_motion_frames(thumbnails, budget, min_change=MOTION_MIN_CHANGE):
+    """Positions of up to `budget` thumbnails, most changed first within equal time segments
+
+    Each of the `budget` segments contributes its frame with the largest difference to the
+    previous scanned frame; a pick that barely differs from the last kept one is dropped, so
+    static clips send fewer frames.
+    """
+    frames = thumbnails.astype(np.int16)
+    diffs = np.abs(np.diff(frames, axis=0)).mean(axis=(1, 2))
+    scores = np.concatenate([diffs[:1], diffs]) if len(diffs) else np.zeros(len(frames))
+    bounds = np.linspace(0, len(frames), min(budget, len(frames)) + 1).astype(int)
+    picks = [start + int(np.argmax(scores[start:stop])) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+    kept = picks[:1]
+    for pick in picks[1:]:
+        if np.abs(frames[pick] - frames[kept[-1]]).mean() >= min_change:
+            kept.append(pick)
+    return kept
+
+def iter_records(path):
+    """Yield the records of a JSON array file, or stream them line by line from a .jsonl file"""
+    with open(path, 'r') as f:
+        if not path.endswith(".jsonl"):
+            yield from json.load(f)
+            return
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # Blank line, or the torn last line of an interrupted run
+                continue
+
+def write_records(path, records):
+    """Atomically write records as a JSON array, or one per line if path ends with .jsonl"""
+    with open(f"{path}.tmp", 'w') as f:
+        if path.endswith(".jsonl"):
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        else:
+            json.dump(list(records), f, indent=2, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+
+class JsonlWriter:
+    """Append JSONL records, flushing each one to the OS and fsyncing every few records or seconds"""
+    def __init__(self, path, sync_every=64, sync_interval=5.0):
+        self.file = open(path, 'a')
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # A crashed process then loses no finished record, only an OS crash can lose the unsynced tail
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+# Steps that can only score 0 are rated locally, in the judge's format, instead of by the judge
+TRIAGE_SCORE = "<score>Step 1: 0/1</score>"
+REFUSAL_STEP = re.compile(r"^\s*(?:<step>)?\s*Step 1:\s*The predicted \w+ (?:is|are) None\.?\s*(?:</step>)?\s*$", re.I)
+
+def triage_step(step):
+    """Reason code of a step that needs no judge ('extraction_error' or 'refusal'), or None"""
+    if not isinstance(step, str) or step.startswith("Error:"):
+        return "extraction_error"
+    if REFUSAL_STEP.match(step):
+        return "refusal"
+    return None
+
+MULTI_PREDICTION_INSTRUCTION = """\
+The model prediction above packs {count} independent predictions for the same video, labelled Prediction 1 to Prediction {count}. \
+Rate each prediction separately following the rating requirements and output exactly {count} <score></score> blocks, \
+one per prediction and in the same order, e.g. Prediction 1: <score>...</score> Prediction 2: <score>...</score>"""
 
 class GPT4Analyzer:
-    def __init__(self, video_dir):
+    def __init__(self, video_dir, frame_sampling="seek", max_frames=10, frame_interval=1, frame_cache=None,
+                 response_cache=None, http_session=None, rate_limiter=None, judge_url=None, judge_authorization=None):
 
         self.video_dir = video_dir
+        self.judge_url = judge_url
+        self.judge_authorization = judge_authorization
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.http_session = http_session or JudgeSession()
+        self.frame_cache = frame_cache
+        self.response_cache = response_cache
+        self.frame_sampling = frame_sampling
+        self.max_frames = max_frames
+        self.frame_interval = frame_interval
+        # Gaps (in frames) larger than this are crossed with a seek instead of grab()
+        self.seek_gap = 64
  
         
-    def extract_key_frames(self, video_path, interval=1):
+    def extract_key_frames(self, video_path, interval=None, max_frames=None, timings=None):
+        interval = self.frame_interval if interval is None else interval
+        max_frames = self.max_frames if max_frames is None else max_frames
+        if self.frame_cache is None:
+            return self._decode_key_frames(video_path, interval, max_frames, timings)
+
+        with timed_stage(timings, "frame_cache"):
+            key = self.frame_cache.key(video_path, sampling=self.frame_sampling, interval=interval, max_frames=max_frames)
+            frames = self.frame_cache.get(key)
+        if frames is None:
+            frames = self._decode_key_frames(video_path, interval, max_frames, timings)
+            if frames:
+                with timed_stage(timings, "frame_cache"):
+                    self.frame_cache.put(key, frames)
+        return frames
+
+    def _decode_key_frames(self, video_path, interval, max_frames, timings=None):
+        if self.frame_sampling == "sequential":
+            return self._extract_key_frames_sequential(video_path, interval, max_frames, timings)
+        if self.frame_sampling == "motion":
+            return self._extract_key_frames_motion(video_path, interval, max_frames, timings)
+        return self._extract_key_frames_seek(video_path, interval, max_frames, timings)
+
+    def _extract_key_frames_sequential(self, video_path, interval, max_frames, timings=None):
   
-        cap = cv2.VideoCapture(video_path)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_interval = int(fps * interval)
+        with timed_stage(timings, "decode"):
+            cap = cv2.VideoCapture(video_path)
+            fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_interval = max(int(fps * interval), 1)
         
         frames = []
         count = 0
         
         while cap.isOpened():
-            ret, frame = cap.read()
+            with timed_stage(timings, "decode"):
+                ret, frame = cap.read()
             if not ret:
                 break
                 
             if count % frame_interval == 0:
-                _, buffer = cv2.imencode('.jpg', frame)
-                frames.append(base64.b64encode(buffer).decode('utf-8'))
+                with timed_stage(timings, "jpeg_encode"):
+                    _, buffer = cv2.imencode('.jpg', frame)
+                with timed_stage(timings, "base64"):
+                    frames.append(base64.b64encode(buffer).decode('utf-8'))
                 
             count += 1
         
         cap.release()
-        return frames[:10]  
+        return frames[:max_frames]  
+
+    def _sample_frame_indices(self, fps, frame_count, interval, max_frames):
+        """Frame indices taken every `interval` seconds, capped at the frame budget"""
+        frame_interval = max(int(fps * interval), 1)
+        return list(range(0, frame_count, frame_interval))[:max_frames]
+
+    def _extract_key_frames_seek(self, video_path, interval, max_frames, timings=None):
+        """Decode only the budgeted frames and stop as soon as the budget is met"""
+        with timed_stage(timings, "decode"):
+            cap = cv2.VideoCapture(video_path)
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if fps <= 0 or frame_count <= 0:
+            # Container metadata is missing, fall back to a full scan
+            cap.release()
+            return self._extract_key_frames_sequential(video_path, interval, max_frames, timings)
+
+        frames = []
+        for frame in self._iter_frames_at(cap, self._sample_frame_indices(fps, frame_count, interval, max_frames), timings):
+            with timed_stage(timings, "jpeg_encode"):
+                _, buffer = cv2.imencode('.jpg', frame)
+            with timed_stage(timings, "base64"):
+                frames.append(base64.b64encode(buffer).decode('utf-8'))
+
+        cap.release()
+        return frames
+
+    def _iter_frames_at(self, cap, indices, timings=None):
+        """Decode the frames at increasing indices, stopping at the first one that cannot be read"""
+        position = 0
+        for index in indices:
+            with timed_stage(timings, "decode"):
+                gap = index - position
+                if gap > self.seek_gap:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+                else:
+                    # Short gaps are cheaper to cross without converting the skipped frames
+                    while gap > 0 and cap.grab():
+                        gap -= 1
+                    if gap > 0:
+                        return
+                ret, frame = cap.read()
+            if not ret:
+                return
+            position = index + 1
+            yield frame
+
+    def _extract_key_frames_motion(self, video_path, interval, max_frames, timings=None):
+        """Spread the frame budget over the whole clip, preferring frames where the picture changes
+
+        The budget is one frame per `interval` seconds of video, at most max_frames. A first pass reads small grayscale thumbnails at MOTION_SCAN_FACTOR points per budgeted
+        frame, select_motion_frames() picks among them by frame differencing, and only the
+        picked frames are decoded again at full resolution.
+        """
+        with timed_stage(timings, "decode"):
+            cap = cv2.VideoCapture(video_path)
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if fps <= 0 or frame_count <= 0:
+            # Without a frame count the clip cannot be scanned ahead, fall back to a full scan
+            cap.release()
+            return self._extract_key_frames_sequential(video_path, interval, max_frames, timings)
+
+        # Never more frames than the interval sampling of seek mode would send for this clip
+        budget = max(1, min(max_frames, math.ceil(frame_count / (fps * interval))))
+        scan_points = min(frame_count, budget * MOTION_SCAN_FACTOR)
+        scan_indices = np.unique(np.linspace(0, frame_count - 1, scan_points).round().astype(int)).tolist()
+        indices = []
+        thumbnails = []
+        for index, frame in zip(scan_indices, self._iter_frames_at(cap, scan_indices, timings)):
+            with timed_stage(timings, "motion_select"):
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                thumbnails.append(cv2.resize(gray, MOTION_THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA))
+            indices.append(index)
+        cap.release()
+        if not thumbnails:
+            return []
+
+        with timed_stage(timings, "motion_select"):
+            picks = select_motion_frames(np.stack(thumbnails), budget)
+
+        frames = []
+        cap = cv2.VideoCapture(video_path)
+        for frame in self._iter_frames_at(cap, [indices[pick] for pick in picks], timings):
+            with timed_stage(timings, "jpeg_encode"):
+                _, buffer = cv2.imencode('.jpg', frame)
+            with timed_stage(timings, "base64"):
+                frames.append(base64.b64encode(buffer).decode('utf-8'))
+        cap.release()
+        return frames
+
+    def video_path(self, video_id):
+        return os.path.join(self.video_dir, f"{video_id}")
+
+    def build_payload(self, entry, frame_base64):
+        """Judge request body for one entry (or a packed group of predictions)"""
+        # Build messages
+        messages = [
+            {
+                "role": "system",
+                "content": "You are an expert in affective computing and very good at handling tasks related to emotion recognition."
+            },
+            {
+                "role": "user",
+                "content": [
+                    # Static instructions and frames lead so the shared prefix can hit provider prompt caching
+                    {"type": "text", "text": """\
+                    I will first give you some ground truth information about the emotion in a video: \
+                    visual clue, audio clue, and sentiment label. I will also give you a model prediction. \
+                    Please help me rate the performance of the prediction. 
+
+                    Rating Requirements:
+                    1. Rate each step using 0 or 1 (0=wrong, 1=correct)
+                    2. For the last step, your rating should be 1 if the predicted fine-grained sentiment matches the ground truth sentiment label, otherwise 0. \
+                    Don't consider visual/audio cues at this step. \
+                    Example 1: The predicted sentiment is negative and the sentiment label is neutral, then the rating should be 0/1. \
+                    Example 2: The predicted sentiment is positive and the sentiment label is strong positive, then the rating should be 0/1. \
+                    Example 3: The predicted sentiment is positive and the sentiment label is strong positive, then the rating should be 1/1. \
+                    Example 4: The predicted sentiment is weak negative and the sentiment label is strong negative, then the rating should be 0/1. \
+                    Example 5: The predicted sentiment is strong negative and the sentiment label is very strong negative, then the rating should be 0/1.  
+                    3. For each other step (except the last step), only consider predictions clearly contradicting visual/audio cues as incorrect
+                    4. Ensure the number of steps in your rating is equal to that in the model prediction
+                    5. Output format: <score>Step 1: 0/1, Step 2: 1/1,...</score>
+
+                    Example Output: 
+                    <score>Step 1: 1/1, Step 2: 0/1, Step 3: 0/1</score>
+
+                    Input Data:
+                    - Visual clue: The video frames (images)"""
+                },
+                    *[{"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}} 
+                    for b64 in frame_base64],
+                    # Per-video data, then the per-model prediction, go last
+                    {"type": "text", "text": f"""\
+                    - Audio clue: '{entry['audio_clue']}'
+                    - Sentiment label: '{entry['ground_truth']}'
+                    - Model prediction: '{entry['step']}'"""
+                }
+                ]
+            }
+        ]
+
+        if entry.get("prediction_count"):
+            messages[1]["content"].append({
+                "type": "text",
+                "text": MULTI_PREDICTION_INSTRUCTION.format(count=entry["prediction_count"])
+            })
+
+        return {
+            "model": "gpt-4o-2024-11-20",
+            "messages": messages,
+            "n": 1,
+            "temperature": 0.0,
+        }
+
+    def analyze_predictions(self, entries):
+        """Judge several predictions for the same video in one request, sending its frames once"""
+        if len(entries) == 1:
+            return [self.analyze_video(entries[0])]
+
+        count = len(entries)
+        packed = dict(entries[0])
+        packed["step"] = " ".join(f"Prediction {i}: {entry['step']}" for i, entry in enumerate(entries, 1))
+        packed["prediction_count"] = count
+        response, error, proc_time, in_toks, out_toks, meta = self.analyze_video(packed)
+        if "timings" in meta:
+            meta = dict(meta, timings={stage: seconds / count for stage, seconds in meta["timings"].items()})
+        if meta.get("packed_mismatch"):
+            analyses = [self.analyze_video(entry) for entry in entries]
+            # The unusable packed reply was still billed, book it on the first prediction
+            first_response, first_error, first_time, first_in, first_out, first_meta = analyses[0]
+            analyses[0] = (
+                first_response,
+                first_error,
+                first_time + proc_time,
+                first_in + in_toks,
+                first_out + out_toks,
+                dict(first_meta, cached_tokens=first_meta.get("cached_tokens", 0) + meta["cached_tokens"])
+            )
+            return analyses
+        if response is None:
+            return [(None, error, proc_time / count, 0, 0, meta)] * count
+
+        # Token usage and time are shared evenly between the packed predictions
+        def share(total, i):
+            return total // count + (1 if i < total % count else 0)
+
+        blocks = re.findall(r'<score>.*?</score>', response, re.S)
+        return [
+            (
+                block,
+                None,
+                proc_time / count,
+                share(in_toks, i),
+                share(out_toks, i),
+                dict(meta, packed=count, cached_tokens=share(meta.get("cached_tokens", 0), i))
+            )
+            for i, block in enumerate(blocks)
+        ]
 
     def analyze_video(self, entry):
-        """Analyze a single video with full tracking"""
+        """Analyze a single video with full tracking
+
+        Returns (response, error, processing_time, input_tokens, output_tokens, meta),
+        where meta records how the verdict was obtained (e.g. a judge cache hit)
+        and the seconds spent in each of TIMING_STAGES.
+        """
         start_time = time.perf_counter()
+        timings = {}
         video_id = entry["video_id"]
-        video_path = os.path.join(self.video_dir, f"{video_id}")
+        video_path = self.video_path(video_id)
         input_tokens = 0
         output_tokens = 0
         max_retries = 20
@@ -52,120 +662,211 @@ class GPT4Analyzer:
 
         try:
             if not os.path.exists(video_path):
-                return None, "Video file missing", 0.0, 0, 0
+                return None, "Video file missing", 0.0, 0, 0, {}
 
             # Extract key frames
-            frame_base64 = self.extract_key_frames(video_path)
+            frame_base64 = self.extract_key_frames(video_path, timings=timings)
             if not frame_base64:
-                return None, "No valid frames extracted", 0.0, 0, 0
+                return None, "No valid frames extracted", 0.0, 0, 0, {"timings": timings}
 
-            # Build messages
-            messages = [
-                {
-                    "role": "system",
-                    "content": "You are an expert in affective computing and very good at handling tasks related to emotion recognition."
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": f"""\
-                        I will first give you some ground truth information about the emotion in a video: \
-                        visual clue, audio clue, and sentiment label. I will also give you a model prediction. \
-                        Please help me rate the performance of the prediction. 
-
-                        Rating Requirements:
-                        1. Rate each step using 0 or 1 (0=wrong, 1=correct)
-                        2. For the last step, your rating should be 1 if the predicted fine-grained sentiment matches the ground truth sentiment label, otherwise 0. \
-                        Don't consider visual/audio cues at this step. \
-                        Example 1: The predicted sentiment is negative and the sentiment label is neutral, then the rating should be 0/1. \
-                        Example 2: The predicted sentiment is positive and the sentiment label is strong positive, then the rating should be 0/1. \
-                        Example 3: The predicted sentiment is positive and the sentiment label is strong positive, then the rating should be 1/1. \
-                        Example 4: The predicted sentiment is weak negative and the sentiment label is strong negative, then the rating should be 0/1. \
-                        Example 5: The predicted sentiment is strong negative and the sentiment label is very strong negative, then the rating should be 0/1.  
-                        3. For each other step (except the last step), only consider predictions clearly contradicting visual/audio cues as incorrect
-                        4. Ensure the number of steps in your rating is equal to that in the model prediction
-                        5. Output format: <score>Step 1: 0/1, Step 2: 1/1,...</score>
-
-                        Input Data:
-                        - Visual clue: The video frames (images)
-                        - Audio clue: '{entry['audio_clue']}'
-                        - Sentiment label: '{entry['ground_truth']}'
-                        - Model prediction: '{entry['step']}'
-
-                        Example Output: 
-                        <score>Step 1: 1/1, Step 2: 0/1, Step 3: 0/1</score>"""
-                    },
-                        *[{"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}} 
-                        for b64 in frame_base64]
-                    ]
-                }
-            ]
+            payload = self.build_payload(entry, frame_base64)
+            messages = payload["messages"]
 
-            url = ""
-            GPT_AUTHORIZATION = ""
+            url = self.judge_url or ""
+            GPT_AUTHORIZATION = self.judge_authorization or ""
             headers = {
                 "content-type": "application/json",
                 "Authorization": f"{GPT_AUTHORIZATION}"
             }
-            payload = {
-                "model": "gpt-4o-2024-11-20",
-                "messages": messages,
-                "n": 1,
-                "temperature": 0.0,
-            }
+
+            cache_key = None
+            if self.response_cache is not None:
+                with timed_stage(timings, "cache_lookup"):
+                    cache_key = self.response_cache.key(payload)
+                    cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    content, input_tokens, output_tokens = cached
+                    processing_time = time.perf_counter() - start_time
+                    return (
+                        content,
+                        None,
+                        processing_time,
+                        input_tokens,
+                        output_tokens,
+                        {"cache_hit": True, "timings": timings}
+                    )
+
+            prompt_text = "".join(
+                message["content"] if isinstance(message["content"], str)
+                else "".join(part.get("text", "") for part in message["content"])
+                for message in messages
+            )
+            reserved_tokens = len(prompt_text) // 4 + IMAGE_TOKEN_ESTIMATE * len(frame_base64)
+
+            # Serialize once, retries resend the same body
+            with timed_stage(timings, "serialize"):
+                body = json.dumps(payload).encode("utf-8")
+
             # Retry loop
             for attempt in range(max_retries):
+                with timed_stage(timings, "rate_limit"):
+                    self.rate_limiter.acquire(reserved_tokens)
+                used_tokens = 0
                 try:
-                    response = requests.post(
-                        url,
-                        json=payload,
-                        headers=headers,
-                        timeout=120
-                    )
+                    with timed_stage(timings, "network"):
+                        response = self.http_session.post(
+                            url,
+                            data=body,
+                            headers=headers,
+                            timeout=120
+                        )
                     response.raise_for_status()
                     
-                    resp_data = json.loads(response.text)
+                    with timed_stage(timings, "parse"):
+                        resp_data = json.loads(response.text)
                     if "error" in resp_data:
                         raise Exception(f"API error: {resp_data['error']['message']}")
                     
                     input_tokens = resp_data["usage"]["prompt_tokens"]
                     output_tokens = resp_data["usage"]["completion_tokens"]
+                    used_tokens = input_tokens + output_tokens
+                    # Prompt tokens served from the provider's prompt cache
+                    prompt_details = resp_data["usage"].get("prompt_tokens_details") or {}
+                    cached_tokens = prompt_details.get("cached_tokens") or 0
+                    
+                    content = resp_data["choices"][0]["message"]["content"]
+                    expected_blocks = entry.get("prediction_count")
+                    if expected_blocks and len(re.findall(r'<score>.*?</score>', content, re.S)) != expected_blocks:
+                        # At temperature 0 a retry would pay for the same reply, the caller judges one by one instead
+                        return (
+                            None,
+                            f"Expected {expected_blocks} <score> blocks for packed predictions",
+                            time.perf_counter() - start_time,
+                            input_tokens,
+                            output_tokens,
+                            {"packed_mismatch": True, "cached_tokens": cached_tokens, "timings": timings}
+                        )
+                    if cache_key is not None:
+                        self.response_cache.put(cache_key, content, input_tokens, output_tokens)
                     
                     processing_time = time.perf_counter() - start_time
                     return (
-                        resp_data["choices"][0]["message"]["content"],
+                        content,
                         None,
                         processing_time,
                         input_tokens,
-                        output_tokens
+                        output_tokens,
+                        {"cache_hit": False, "cached_tokens": cached_tokens, "timings": timings}
                     )
                     
                 except Exception as e:
                     error_log.append(str(e))
                     print(f"Attempt {attempt+1} failed: {str(e)}")
                     if attempt < max_retries - 1:
-                        sleep_time = retry_delay
-                        print(f"Retrying in {sleep_time}s...")
-                        time.sleep(sleep_time)
+                        retry_after = parse_retry_after(getattr(e, "response", None))
+                        if retry_after is not None:
+                            # The provider asked every client to back off, not just this request
+                            self.rate_limiter.pause(retry_after)
+                            sleep_time = retry_after
+                        else:
+                            sleep_time = backoff_delay(attempt, retry_delay)
+                        print(f"Retrying in {sleep_time:.1f}s...")
+                        with timed_stage(timings, "retry_sleep"):
+                            time.sleep(sleep_time)
+                finally:
+                    self.rate_limiter.record_usage(reserved_tokens, used_tokens)
             
             raise Exception(f"All {max_retries} attempts failed. Errors: {', '.join(error_log)}")
             
         except Exception as e:
             processing_time = time.perf_counter() - start_time
             print(f"Final error: {str(e)}")
-            return None, str(e), processing_time, 0, 0
+            return None, str(e), processing_time, 0, 0, {"timings": timings}
 
 class EvaluationPipeline:
-    def __init__(self, video_dir):
-        self.analyzer = GPT4Analyzer(video_dir)
+    def __init__(self, video_dir, concurrency=1, pool_size=None, rpm=0, tpm=0, triage=True, **analyzer_kwargs):
+        self.video_dir = video_dir
+        self.concurrency = max(concurrency, 1)
+        self.triage = triage
+        self.http_session = JudgeSession(pool_size or self.concurrency)
+        self.analyzer = GPT4Analyzer(
+            video_dir,
+            http_session=self.http_session,
+            rate_limiter=RateLimiter(rpm, tpm),
+            **analyzer_kwargs
+        )
+
+    def schedule_units(self, dataset, units):
+        """Group work units by video so the requests of one video run back to back"""
+        groups = {}
+        for position, unit in enumerate(units):
+            groups.setdefault(dataset[unit[0]]["video_id"], []).append(position)
+        return list(groups.values())
+
+    def run_group(self, units):
+        # Sequential on one worker: the first request warms the provider's prompt cache for the rest
+        return [self.analyzer.analyze_predictions(unit) for unit in units]
+
+    def iter_analyses(self, units, groups):
+        """Yield (position, analyses) per work unit, keeping up to `concurrency` video groups in flight"""
+        if self.concurrency == 1:
+            for group in groups:
+                for position in group:
+                    yield position, self.analyzer.analyze_predictions(units[position])
+            return
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending = {}
+            # Submit lazily so only a bounded window of work is queued at any time
+            for group in groups:
+                pending[executor.submit(self.run_group, [units[position] for position in group])] = group
+                if len(pending) < 2 * self.concurrency:
+                    continue
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from zip(pending.pop(future), future.result())
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from zip(pending.pop(future), future.result())
+
+    def prewarm_frame_cache(self):
+        """Extract and cache key frames for every video under video_dir"""
+        video_paths = []
+        for root, _, files in os.walk(self.video_dir):
+            for name in sorted(files):
+                if name.lower().endswith(VIDEO_EXTENSIONS):
+                    video_paths.append(os.path.join(root, name))
+
+        failed = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            extracted = executor.map(self.analyzer.extract_key_frames, video_paths)
+            for frames in tqdm(extracted, total=len(video_paths), desc="Prewarming frame cache"):
+                if not frames:
+                    failed += 1
+
+        cache = self.analyzer.frame_cache
+        print(f"\nPrewarmed {len(video_paths) - failed}/{len(video_paths)} videos "
+              f"({cache.hits} already cached, {cache.total_bytes / 1024 ** 2:.1f} MiB on disk)")
     
-    def process_dataset(self, audio_json, response_json, output_json):
-        """Batch process dataset with full metrics"""
-        total_start = time.perf_counter()
-        
-        with open(response_json, 'r') as f:
-            step_data = json.load(f)
-        
+    def load_checkpoint(self, checkpoint_path):
+        """Index successfully judged checkpoint records by video_id"""
+        finished = {}
+        if not os.path.exists(checkpoint_path):
+            return finished
+        with open(checkpoint_path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last line of an interrupted run
+                    continue
+                if record.get("score") is not None:
+                    finished[record["video_id"]] = record
+        return finished
+
+    def load_dataset(self, audio_json, response_jsons):
+        """Merge audio clues into the step entries of every response file, tagging each with its source"""
         with open(audio_json, 'r') as f:
             audio_data = json.load(f)
 
@@ -173,93 +874,462 @@ class EvaluationPipeline:
 
         dataset = []
 
-        for step_item in step_data:
-            video_id = step_item["video_id"]
-            
-            audio_item = audio_dict.get(video_id)
-            
-            if audio_item:
-                merged_item = {
-                    "video_id": video_id,
-                    "audio_clue": audio_item["audio_clue"],
-                    "ground_truth": step_item["ground_truth"],
-                    "model_response": step_item["model_response"],
-                    "step": step_item["step"]
-                }
-                dataset.append(merged_item)
-            else:
-                print(f"Warning: Missing audio data for video {video_id}")
+        for source, path in enumerate(response_jsons):
+            for step_item in iter_records(path):
+                video_id = step_item["video_id"]
+                
+                audio_item = audio_dict.get(video_id)
+                
+                if audio_item:
+                    merged_item = {
+                        "video_id": video_id,
+                        "audio_clue": audio_item["audio_clue"],
+                        "ground_truth": step_item["ground_truth"],
+                        "model_response": step_item["model_response"],
+                        "step": step_item["step"],
+                        "source": source
+                    }
+                    dataset.append(merged_item)
+                else:
+                    print(f"Warning: Missing audio data for video {video_id}")
 
         #dataset = dataset[:10]
-        
+        return dataset
+
+    def triage_record(self, item):
+        """Output record of an item whose step needs no judge, or None if it has to be judged"""
+        reason = triage_step(item["step"]) if self.triage else None
+        if reason is None:
+            return None
+        return {
+            "video_id": item['video_id'],
+            "ground_truth": item['ground_truth'],
+            "model_response": item["model_response"],
+            "step": item["step"],
+            "score": TRIAGE_SCORE,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cached_tokens": 0,
+            "triage": reason
+        }
+
+    def write_batch_requests(self, audio_json, response_json, batch_dir, max_shard_bytes=190 * 1024 ** 2):
+        """Write judge requests as Batch API input JSONL shards, one line per video with custom_id = video_id
+
+        Triaged items get no request; ingest rates them again.
+        """
+        dataset = [item for item in self.load_dataset(audio_json, [response_json]) if self.triage_record(item) is None]
+        os.makedirs(batch_dir, exist_ok=True)
+
+        def extract(item):
+            video_path = self.analyzer.video_path(item["video_id"])
+            # The frame cache keys videos by os.stat, so a missing file would abort the whole run
+            if not os.path.exists(video_path):
+                return item, None
+            return item, self.analyzer.extract_key_frames(video_path)
+
+        shard_paths = []
+        shard = None
+        written = 0
+        skipped = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for item, frames in tqdm(executor.map(extract, dataset), total=len(dataset), desc="Writing batch requests"):
+                if frames is None:
+                    print(f"Warning: Video file missing for {item['video_id']}, not batched")
+                    skipped += 1
+                    continue
+                if not frames:
+                    print(f"Warning: No valid frames for video {item['video_id']}, not batched")
+                    skipped += 1
+                    continue
+                line = json.dumps({
+                    "custom_id": item["video_id"],
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": self.analyzer.build_payload(item, frames)
+                }, ensure_ascii=False) + "\n"
+                # Providers cap the size of a batch input file, so roll over to a new shard
+                if shard is None or shard.tell() + len(line.encode("utf-8")) > max_shard_bytes:
+                    if shard is not None:
+                        shard.close()
+                    shard_paths.append(os.path.join(batch_dir, f"batch_requests_{len(shard_paths):03d}.jsonl"))
+                    shard = open(shard_paths[-1], 'w')
+                shard.write(line)
+                written += 1
+        if shard is not None:
+            shard.close()
+
+        print(f"\nWrote {written} batch requests ({skipped} skipped) to {len(shard_paths)} file(s) in {batch_dir}")
+
+    def ingest_batch_outputs(self, audio_json, response_json, output_json, batch_dir):
+        """Map Batch API output files (*output*.jsonl in batch_dir) back onto the output_json schema"""
+        dataset = self.load_dataset(audio_json, [response_json])
+
+        responses = {}
+        for name in sorted(os.listdir(batch_dir)):
+            if "output" not in name or not name.endswith(".jsonl"):
+                continue
+            with open(os.path.join(batch_dir, name), 'r') as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        responses[record["custom_id"]] = record
+
         results = []
-        total_processing_time = 0.0
+        failed = 0
         total_input_tokens = 0
         total_output_tokens = 0
-        
-        for item in tqdm(dataset, desc="Processing Videos"):
-            raw_response, error, proc_time, in_toks, out_toks = self.analyzer.analyze_video(item)
-            
-            total_processing_time += proc_time
+        for item in dataset:
+            triaged = self.triage_record(item)
+            if triaged is not None:
+                results.append(triaged)
+                continue
+            record = responses.get(item["video_id"]) or {}
+            response = record.get("response") or {}
+            body = response.get("body") or {}
+            score = None
+            in_toks = out_toks = cached_tokens = 0
+            if response.get("status_code") == 200 and body.get("choices"):
+                score = body["choices"][0]["message"]["content"]
+                usage = body.get("usage") or {}
+                in_toks = usage.get("prompt_tokens", 0)
+                out_toks = usage.get("completion_tokens", 0)
+                cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+            else:
+                failed += 1
             total_input_tokens += in_toks
             total_output_tokens += out_toks
-            
-            result = {
+            results.append({
                 "video_id": item['video_id'],
                 "ground_truth": item['ground_truth'],
                 "model_response": item["model_response"],
                 "step": item["step"],
-                "score": raw_response,
+                "score": score,
                 "input_tokens": in_toks,
-                "output_tokens": out_toks
+                "output_tokens": out_toks,
+                "cached_tokens": cached_tokens
+            })
+
+        write_records(output_json, results)
+
+        print("\n=== Batch Ingest Report ===")
+        print(f"Total videos: {len(dataset)}")
+        print(f"Missing or failed in batch output: {failed}")
+        print(f"Triaged without the judge: {sum('triage' in result for result in results)}")
+        print(f"Total input tokens: {total_input_tokens}")
+        print(f"Total output tokens: {total_output_tokens}")
+        print(f"\nResults saved to: {output_json}")
+
+    def pack_units(self, dataset, indices, pack_size):
+        """Split indices into work units of up to pack_size predictions for the same video"""
+        by_video = {}
+        for index in indices:
+            by_video.setdefault(dataset[index]["video_id"], []).append(index)
+        units = []
+        for group in by_video.values():
+            for start in range(0, len(group), pack_size):
+                units.append(group[start:start + pack_size])
+        return units
+
+    def report_timings(self, timed_items, timings_json=None):
+        """Print per-stage totals and percentiles, optionally saving them with per-video timings"""
+        stages = {}
+        for stage in TIMING_STAGES:
+            values = [timings.get(stage, 0.0) for _, timings in timed_items]
+            if not any(values):
+                continue
+            stages[stage] = {
+                "total": sum(values),
+                "mean": sum(values) / len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99)
             }
-            results.append(result)
+        total = sum(stage["total"] for stage in stages.values())
+
+        print(f"\nStage Timings (per video, seconds):")
+        print(f"{'stage':<14}{'total':>10}{'share':>8}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+        for stage, summary in stages.items():
+            print(f"{stage:<14}{summary['total']:>10.2f}{100 * summary['total'] / max(total, 1e-9):>7.1f}%"
+                  f"{summary['mean']:>9.3f}{summary['p50']:>9.3f}{summary['p95']:>9.3f}{summary['p99']:>9.3f}")
+
+        if timings_json:
+            with open(f"{timings_json}.tmp", 'w') as f:
+                json.dump({
+                    "videos": len(timed_items),
+                    "concurrency": self.concurrency,
+                    "stages": stages,
+                    "per_video": [dict(timings, video_id=video_id) for video_id, timings in timed_items]
+                }, f, indent=2)
+            os.replace(f"{timings_json}.tmp", timings_json)
+            print(f"Stage timings saved to: {timings_json}")
+
+    def process_dataset(self, audio_json, response_json, output_json, resume=False, checkpoint_jsonl=None,
+                        pack_size=1, timings_json=None):
+        """Batch process dataset with full metrics
+
+        response_json and output_json may also be parallel lists, one pair per evaluated model.
+        Predictions for the same video are then judged together, up to pack_size per request.
+        An output path ending in .jsonl is streamed: records are appended as they finish, in
+        completion order, and the file doubles as its own checkpoint.
+        """
+        total_start = time.perf_counter()
+        response_jsons = [response_json] if isinstance(response_json, str) else list(response_json)
+        output_jsons = [output_json] if isinstance(output_json, str) else list(output_json)
+        if len(response_jsons) != len(output_jsons):
+            raise ValueError("Each response JSON needs a matching output JSON")
+        if checkpoint_jsonl and len(output_jsons) > 1:
+            raise ValueError("A custom checkpoint path only supports a single output JSON")
+        streamed = [path.endswith(".jsonl") for path in output_jsons]
+        if checkpoint_jsonl and any(streamed):
+            raise ValueError("A .jsonl output is its own checkpoint, drop the custom checkpoint path")
+        pack_size = max(pack_size, 1)
+        dataset = self.load_dataset(audio_json, response_jsons)
+        
+        checkpoint_paths = [
+            path if stream else checkpoint_jsonl or f"{path}.ckpt.jsonl"
+            for path, stream in zip(output_jsons, streamed)
+        ]
+        if not resume:
+            for path in checkpoint_paths:
+                if os.path.exists(path) and os.path.getsize(path) > 0:
+                    # Starting over would truncate judged (and paid for) records
+                    raise FileExistsError(f"Checkpoint {path} already holds judged records; "
+                                          f"pass --resume to continue it, or remove it to start over")
+        finished = [self.load_checkpoint(path) if resume else {} for path in checkpoint_paths]
+
+        results = [None] * len(dataset)
+        pending = []
+        for index, item in enumerate(dataset):
+            record = finished[item["source"]].get(item["video_id"])
+            if record is not None:
+                results[index] = record
+            else:
+                pending.append(index)
+        restored = len(dataset) - len(pending)
+
+        # Extraction errors and refusals can only score 0, so only real reasoning chains go to the judge
+        triage_counts = {}
+        for index in pending:
+            record = self.triage_record(dataset[index])
+            if record is not None:
+                results[index] = record
+                triage_counts[record["triage"]] = triage_counts.get(record["triage"], 0) + 1
+        pending = [index for index in pending if results[index] is None]
+
+        # Start the checkpoints over with the reused and triaged records, dropping torn and errored lines
+        for source, checkpoint_path in enumerate(checkpoint_paths):
+            write_records(checkpoint_path, (
+                result for item, result in zip(dataset, results)
+                if result is not None and item["source"] == source
+            ))
+        if resume:
+            print(f"Resuming: {restored} judged, {len(dataset) - restored} remaining")
+
+        # Predictions of different models for one video share a request, so its frames are sent once
+        units = self.pack_units(dataset, pending, pack_size)
+        groups = self.schedule_units(dataset, units)
+
+        total_processing_time = 0.0
+        total_input_tokens = 0
+        total_output_tokens = 0
+        cache_hits = 0
+        cached_input_tokens = 0
+        cached_output_tokens = 0
+        provider_cached_tokens = 0
+        timed_items = []
+        
+        checkpoints = [JsonlWriter(path) for path in checkpoint_paths]
+        try:
+            analyses = self.iter_analyses([[dataset[index] for index in unit] for unit in units], groups)
+            for position, unit_analyses in tqdm(analyses, total=len(units), desc="Processing Videos"):
+                for index, analysis in zip(units[position], unit_analyses):
+                    item = dataset[index]
+                    raw_response, error, proc_time, in_toks, out_toks, meta = analysis
+                
+                    total_processing_time += proc_time
+                    if "timings" in meta:
+                        timed_items.append((item["video_id"], meta["timings"]))
+                    if meta.get("cache_hit"):
+                        # Replayed verdicts cost nothing, keep them out of the billed totals
+                        cache_hits += 1
+                        cached_input_tokens += in_toks
+                        cached_output_tokens += out_toks
+                    else:
+                        total_input_tokens += in_toks
+                        total_output_tokens += out_toks
+                        provider_cached_tokens += meta.get("cached_tokens", 0)
+                
+                    result = {
+                        "video_id": item['video_id'],
+                        "ground_truth": item['ground_truth'],
+                        "model_response": item["model_response"],
+                        "step": item["step"],
+                        "score": raw_response,
+                        "input_tokens": in_toks,
+                        "output_tokens": out_toks,
+                        "cached_tokens": meta.get("cached_tokens", 0)
+                    }
+                    # Streamed outputs already hold the record, so it is not kept in memory
+                    if not streamed[item["source"]]:
+                        results[index] = result
+                    checkpoints[item["source"]].write(result)
+        finally:
+            for checkpoint in checkpoints:
+                checkpoint.close()
         
-        # Save results
-        with open(output_json, 'w') as f:
-            json.dump(results, f, indent=2, ensure_ascii=False)
+        # Save results atomically so an interrupted write never leaves a truncated file
+        for source, path in enumerate(output_jsons):
+            if not streamed[source]:
+                write_records(path, [result for item, result in zip(dataset, results) if item["source"] == source])
         
         # Calculate statistics
+        judged = max(len(pending), 1)
         total_time = time.perf_counter() - total_start
-        avg_time = total_processing_time / len(dataset)
-        avg_input_tokens = total_input_tokens / len(dataset)
-        avg_output_tokens = total_output_tokens / len(dataset)
+        avg_time = total_processing_time / judged
+        avg_input_tokens = total_input_tokens / judged
+        avg_output_tokens = total_output_tokens / judged
         
         # Print report
         print("\n=== Analysis Report ===")
         print(f"Total videos processed: {len(dataset)}")
+        print(f"Restored from checkpoint: {restored}")
+        print(f"Triaged without the judge: {sum(triage_counts.values())}"
+              + "".join(f", {reason}: {count}" for reason, count in sorted(triage_counts.items())))
+        print(f"Judge requests: {len(units)} (up to {pack_size} predictions each)")
+        print(f"Concurrency: {self.concurrency}")
         print(f"Total wall time: {timedelta(seconds=int(total_time))}")
         print(f"Total processing time: {timedelta(seconds=int(total_processing_time))}")
         print(f"Average time per video: {avg_time:.2f}s")
         print(f"\nToken Usage:")
         print(f"Total input tokens: {total_input_tokens}")
         print(f"Total output tokens: {total_output_tokens}")
+        print(f"Prompt-cached input tokens: {provider_cached_tokens} "
+              f"({100 * provider_cached_tokens / max(total_input_tokens, 1):.1f}% of input)")
         print(f"Average input tokens/video: {avg_input_tokens:.1f}")
         print(f"Average output tokens/video: {avg_output_tokens:.1f}")
-        print(f"\nResults saved to: {output_json}")
+        if self.analyzer.response_cache is not None:
+            print(f"\nJudge cache hits: {cache_hits}")
+            print(f"Cached input tokens (not billed): {cached_input_tokens}")
+            print(f"Cached output tokens (not billed): {cached_output_tokens}")
+        if timed_items:
+            self.report_timings(timed_items, timings_json)
+        connection_stats = self.http_session.stats()
+        print(f"\nHTTP requests sent: {connection_stats['requests']}")
+        print(f"Connections opened: {connection_stats['connections']}")
+        print(f"Connection reuses: {connection_stats['reused']}")
+        if self.analyzer.frame_cache is not None:
+            print(f"\nFrame cache hits: {self.analyzer.frame_cache.hits}")
+            print(f"Frame cache misses: {self.analyzer.frame_cache.misses}")
+        print(f"\nResults saved to: {', '.join(output_jsons)}")
 
 def main():
     parser = argparse.ArgumentParser(description="GPT-4o Video Emotion Analysis")
-    parser.add_argument("--response_json", type=str, default="",
-                       help="Response JSON file path")
-    parser.add_argument("--output_json", type=str, default="",
-                       help="Output JSON file path")
+    parser.add_argument("--response_json", type=str, nargs="+", default=[""],
+                       help="Response JSON (or JSONL) file path(s), one per evaluated model")
+    parser.add_argument("--output_json", type=str, nargs="+", default=[""],
+                       help="Output JSON file path(s), matching --response_json (.jsonl: stream records as they finish)")
     parser.add_argument("--audio_json", type=str, default="",
                        help="audio JSON file path")
     parser.add_argument("--video_dir", type=str, default="",
                        help="Base directory for video files")
+    parser.add_argument("--judge_url", type=str, default="",
+                       help="Chat completions endpoint of the judge (overrides the url set in analyze_video)")
+    parser.add_argument("--judge_authorization", type=str, default="",
+                       help="Authorization header value for --judge_url")
+    parser.add_argument("--frame_sampling", type=str, default="seek", choices=["seek", "sequential", "motion"],
+                       help="seek: decode only the sampled frames; sequential: read every frame; "
+                            "motion: spread up to --max_frames over the whole clip, preferring changing frames")
+    parser.add_argument("--max_frames", type=int, default=10,
+                       help="Maximum number of frames sent to the judge")
+    parser.add_argument("--frame_interval", type=float, default=1,
+                       help="Seconds between sampled frames")
+    parser.add_argument("--pack_size", type=int, default=1,
+                       help="Predictions for the same video judged in one request (with multiple --response_json)")
+    parser.add_argument("--concurrency", type=int, default=1,
+                       help="Number of judge requests kept in flight")
+    parser.add_argument("--pool_size", type=int, default=0,
+                       help="Keep-alive connections in the HTTP pool (default: match --concurrency)")
+    parser.add_argument("--rpm", type=int, default=0,
+                       help="Judge requests-per-minute budget (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=0,
+                       help="Judge tokens-per-minute budget (0 = unlimited)")
+    parser.add_argument("--response_cache_db", type=str, default="",
+                       help="SQLite file caching judge responses by payload hash (disabled if empty)")
+    parser.add_argument("--checkpoint_jsonl", type=str, default="",
+                       help="Append-only checkpoint file (default: <output_json>.ckpt.jsonl)")
+    parser.add_argument("--resume", action="store_true",
+                       help="Reuse judged entries from the checkpoint and judge only missing or errored ones")
+    parser.add_argument("--timings_json", type=str, default="",
+                       help="Save per-stage timing totals, percentiles and per-video timings to this file")
+    parser.add_argument("--batch_mode", type=str, default="", choices=["", "write", "ingest"],
+                       help="write: dump Batch API request files instead of calling the judge; "
+                            "ingest: build --output_json from Batch API output files")
+    parser.add_argument("--batch_dir", type=str, default="",
+                       help="Directory holding batch request and output JSONL files")
+    parser.add_argument("--frame_cache_dir", type=str, default="",
+                       help="Directory of the persistent key frame cache (disabled if empty)")
+    parser.add_argument("--frame_cache_size_gb", type=float, default=20,
+                       help="Frame cache size limit before LRU eviction")
+    parser.add_argument("--prewarm_cache", action="store_true",
+                       help="Only fill the frame cache for every video in --video_dir, then exit")
+    parser.add_argument("--no_triage", action="store_true",
+                       help="Send extraction errors and refusal steps to the judge instead of rating them 0")
     
     args = parser.parse_args()
     
     
     # Validate paths
-    if not os.path.exists(args.video_dir):
+    if args.batch_mode != "ingest" and not os.path.exists(args.video_dir):
         raise FileNotFoundError(f"Video directory not found: {args.video_dir}")
+    if args.batch_mode and (not args.batch_dir or len(args.response_json) != 1):
+        raise ValueError("--batch_mode needs --batch_dir and a single --response_json")
     
+    frame_cache = None
+    if args.frame_cache_dir:
+        frame_cache = FrameCache(args.frame_cache_dir, int(args.frame_cache_size_gb * 1024 ** 3))
+    elif args.prewarm_cache:
+        raise ValueError("--prewarm_cache requires --frame_cache_dir")
+
     # Run pipeline
     start_time = time.perf_counter()
-    pipeline = EvaluationPipeline(args.video_dir)
-    pipeline.process_dataset(args.audio_json, args.response_json, args.output_json)
+    pipeline = EvaluationPipeline(
+        args.video_dir,
+        concurrency=args.concurrency,
+        pool_size=args.pool_size or None,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        frame_sampling=args.frame_sampling,
+        max_frames=args.max_frames,
+        frame_interval=args.frame_interval,
+        frame_cache=frame_cache,
+        judge_url=args.judge_url or None,
+        judge_authorization=args.judge_authorization or None,
+        response_cache=ResponseCache(args.response_cache_db) if args.response_cache_db else None,
+        triage=not args.no_triage
+    )
+    if args.prewarm_cache:
+        pipeline.prewarm_frame_cache()
+        print(f"\nTotal execution time: {time.perf_counter()-start_time:.2f}s")
+        return
+    if args.batch_mode == "write":
+        pipeline.write_batch_requests(args.audio_json, args.response_json[0], args.batch_dir)
+        print(f"\nTotal execution time: {time.perf_counter()-start_time:.2f}s")
+        return
+    if args.batch_mode == "ingest":
+        pipeline.ingest_batch_outputs(args.audio_json, args.response_json[0], args.output_json[0], args.batch_dir)
+        print(f"\nTotal execution time: {time.perf_counter()-start_time:.2f}s")
+        return
+    pipeline.process_dataset(
+        args.audio_json,
+        args.response_json,
+        args.output_json,
+        resume=args.resume,
+        checkpoint_jsonl=args.checkpoint_jsonl or None,
+        pack_size=args.pack_size,
+        timings_json=args.timings_json or None
+    )
+    pipeline.http_session.close()
     
     print(f"\nTotal execution time: {time.perf_counter()-start_time:.2f}s")
 
@@ -1,352 +1,156 @@
 import argparse
-import json
-import re
-from collections import defaultdict
+import csv
+import glob
+import os
+import sys
+
+# The parsing, scoring and report code is shared by every task in eval_cot/metrics_engine.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from metrics_engine import TASKS, MetricsState, load_manifest, run_all, save_results, summarize
+
+TASK = TASKS["Overall"]
+EVAL_COT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+
+# Results files are named <prefix>_<model tag>_eval.json under eval_cot/<task>/results
+TASK_FILE_PREFIXES = {
+    "ER-Lab": "ER_Lab",
+    "ER-Wild": "ER_SL_Wild",
+    "ML-ER": "ML_ER",
+    "FG-ER": "FG_ER",
+    "Noise-ER": "Noise_ER",
+    "IR": "IR",
+    "SA": "SA",
+    "FG-SA": "FG_SA"
+}
+
+# Leaderboard names of the model tags; unknown tags are listed under the tag itself
+MODEL_NAMES = {
+    'affectgpt': 'AffectGPT',
+    'audio_reasoner': 'Audio_Reasoner',
+    'Emotion-LLaMA': 'Emotion-LLaMA',
+    'gemini_2.0_flash': 'Gemini_2.0_Flash',
+    'gemini_2.5_flash': 'Gemini_2.5_Flash',
+    'gemini_2.5_pro': 'Gemini_2.5_Pro',
+    'gpt4.1': 'GPT-4.1',
+    'gpt4o': 'GPT-4o',
+    'humanomni_7b': 'HumanOmni-7B',
+    'qvq_72b': 'QVQ-72B',
+    'qwen2_audio': 'Qwen2-Audio',
+    'qwen2.5_omni_7b': 'Qwen2.5-Omni-7B',
+    'qwen2.5vl_72b': 'Qwen2.5-VL-72B',
+    'qwen2.5vl_7b': 'Qwen2.5-VL-7B',
+    'qwen2vl_72b': 'Qwen2-VL-72B',
+    'qwen2vl_7b': 'Qwen2-VL-7B',
+    'r1_omni_0.5b': 'R1-Omni-0.5B',
+    'VideoLLaMA': 'VideoLLaMA',
+    'VideoLLaMA2': 'VideoLLaMA2',
+    'VideoLLaVA': 'VideoLLaVA'
+}
+
+def discover_results(results_root):
+    """(task, model, path) for every results file under results_root/<task>/results
+
+    A streamed .jsonl output is used only when the model has no .json one for that task.
+    """
+    found = {}
+    for task, prefix in TASK_FILE_PREFIXES.items():
+        for extension in (".jsonl", ".json"):
+            pattern = os.path.join(results_root, task, "results", f"{glob.escape(prefix)}_*_eval{extension}")
+            for path in sorted(glob.glob(pattern)):
+                tag = os.path.basename(path)[len(prefix) + 1:-len(f"_eval{extension}")]
+                found[(task, MODEL_NAMES.get(tag, tag))] = path
+    return [(task, model, path) for (task, model), path in sorted(found.items())]
+
+def write_leaderboard(results, output_dir, alpha):
+    """Write the model x task x metric table, best Overall CoT Score first, and print its CoT column"""
+    tasks = ["Overall"] + list(TASK_FILE_PREFIXES)
+
+    def overall_cot(model):
+        stats = results.get(("Overall", model))
+        return summarize(stats['total'], alpha)[2] if stats else 0.0
+
+    models = sorted(set(model for _, model in results), key=overall_cot, reverse=True)
+    with_ci = all('ci' in stats for stats in results.values())
+    metrics = ("Recognition", "Reasoning", "CoT", "Count") + (("CoT CI Low", "CoT CI High") if with_ci else ())
+
+    leaderboard_csv = os.path.join(output_dir, "leaderboard.csv")
+    with open(leaderboard_csv, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Model"] + [f"{task} {metric}" for task in tasks for metric in metrics])
+        for model in models:
+            row = [model]
+            for task in tasks:
+                stats = results.get((task, model))
+                if stats is None:
+                    row.extend([""] * len(metrics))
+                    continue
+                avg_acc, avg_reason, combined_score, _ = summarize(stats['total'], alpha)
+                row.extend([f"{100*avg_acc:.1f}", f"{100*avg_reason:.1f}", f"{100*combined_score:.1f}",
+                            stats['total']['count']])
+                if with_ci:
+                    row.extend([f"{100*bound:.1f}" for bound in stats['ci']['total']['cot']])
+            writer.writerow(row)
+
+    print(f"{'Model':<18}" + "".join(f"{task:>10}" for task in tasks) + "   (CoT Score)")
+    for model in models:
+        cells = []
+        for task in tasks:
+            stats = results.get((task, model))
+            cells.append(f"{100*summarize(stats['total'], alpha)[2]:>10.1f}" if stats else f"{'-':>10}")
+        print(f"{model:<18}" + "".join(cells))
+    return leaderboard_csv
 
-def parse_score(score_str):
-    match = re.search(r'<score>(.*?)</score>', score_str)
-    if not match:
-        return None
-    
-    scores = []
-  
-    for m in re.finditer(r':\s*(\d+)/(\d+)', match.group(1)):
-        numerator = int(m.group(1))
-        denominator = int(m.group(2))
-   
-        if denominator == 0:
-            scores.append(0.0)
-        else:
-            scores.append(numerator / denominator)
-    return scores
-
-def calculate_metrics(scores):
-    if not scores:
-        return 0.0, 0.0, 0
- 
-    acc_score = scores[-1]
-    reasoning_scores = scores[:-1] if len(scores) > 1 else []
-    reasoning_avg = sum(reasoning_scores)/len(reasoning_scores) if reasoning_scores else 0.0
-    return acc_score, reasoning_avg, len(scores)
-
-def process_data(data):
-
-    
-    stats = {
-        'total': {'acc':0.0, 'reason':0.0, 'count':0, 'step':0}
-    }
-
-    for entry in data:
-        scores = parse_score(str(entry['score']))
-        if not scores: 
-            continue
-        
-        acc, reasoning, step_count = calculate_metrics(scores)
-        cat = entry['ground_truth']
-
- 
-        stats['total']['acc'] += acc
-        stats['total']['reason'] += reasoning
-        stats['total']['step'] += step_count
-        stats['total']['count'] += 1
-        
-    return stats
-
-def save_results(args, stats):
-    total = stats['total']
-    avg_acc = total['acc'] / total['count'] if total['count'] else 0
-    avg_reason = total['reason'] / total['count'] if total['count'] else 0
-    avg_step = total['step'] / total['count'] if total['count'] else 0
-    combined_score = args.alpha * avg_acc + (1 - args.alpha) * avg_reason
-
-    with open(args.output_txt, 'w') as f:
-        f.write(f"Model: {args.model_name}\n")
-        f.write(f"Alpha: {args.alpha:.1f}\n\n")
-        
-        f.write("=== Overall Metrics ===\n")
-        f.write(f"Total Count: {total['count']}\n")
-        f.write(f"Recognition Score: {100*avg_acc:.1f}\n")
-        f.write(f"Reasoning Score: {100*avg_reason:.1f}\n")
-        f.write(f"CoT Score: {100*combined_score:.1f}\n")
-        f.write(f"Avg Steps: {avg_step:.1f}\n\n")
-        
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Emotion Analysis Metrics Calculator")
-    parser.add_argument("--output_txt", type=str, default='', help="Output text file path")
-    parser.add_argument("--model_name", type=str, default='', help="Name of the evaluated model")
+    parser.add_argument("--results_root", type=str, default=EVAL_COT_DIR,
+                        help="Directory holding <task>/results/*_eval.json (default: eval_cot)")
+    parser.add_argument("--manifest", type=str, default='',
+                        help="JSON list of {\"task\", \"model\", \"path\"} objects used instead of discovery")
+    parser.add_argument("--output_dir", type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "results"),
+                        help="Directory for the leaderboard and per task/model metrics files")
+    parser.add_argument("--output_txt", type=str, default='', help="Also write the Overall metrics of --model_name here")
+    parser.add_argument("--model_name", type=str, default='', help="Only score this model (default: every model found)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes loading results files")
+    parser.add_argument("--state_db", type=str, default='',
+                        help="SQLite store of per-file metric sums, so only changed files are rescored "
+                             "(default: <output_dir>/metrics_state.db)")
+    parser.add_argument("--bootstrap", type=int, default=0,
+                        help="Bootstrap resamples for CIs, also added to the leaderboard (0 = point estimates only)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the bootstrap resampling")
+    parser.add_argument("--no_sidecar", action="store_true",
+                        help="Always parse the results files instead of reading/writing .npz score sidecars")
     parser.add_argument("--alpha", type=float, default=0.5, help="Weighting factor", metavar="[0.0-1.0]")
-    
-    args = parser.parse_args()
-    
-  
-    if not 0 <= args.alpha <= 1:
-        raise ValueError("Lambda must be between 0 and 1")
-    
-    if args.model_name == 'AffectGPT':
-        args.output_txt = '/metrics/results/Overall_affectgpt_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_affectgpt_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_affectgpt_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_affectgpt_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_affectgpt_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_affectgpt_eval.json',
-            '/eval_cot/IR/results/IR_affectgpt_eval.json',
-            '/eval_cot/SA/results/SA_affectgpt_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_affectgpt_eval.json'
-        ]
-    
-    if args.model_name == 'Audio_Reasoner':
-        args.output_txt = '/metrics/results/Overall_audio_reasoner_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_audio_reasoner_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_audio_reasoner_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_audio_reasoner_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_audio_reasoner_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_audio_reasoner_eval.json',
-            '/eval_cot/IR/results/IR_audio_reasoner_eval.json',
-            '/eval_cot/SA/results/SA_audio_reasoner_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_audio_reasoner_eval.json'
-        ]
-
-    if args.model_name == 'Emotion-LLaMA':
-        args.output_txt = '/metrics/results/Overall_Emotion-LLaMA_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_Emotion-LLaMA_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_Emotion-LLaMA_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_Emotion-LLaMA_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_Emotion-LLaMA_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_Emotion-LLaMA_eval.json',
-            '/eval_cot/IR/results/IR_Emotion-LLaMA_eval.json',
-            '/eval_cot/SA/results/SA_Emotion-LLaMA_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_Emotion-LLaMA_eval.json'
-        ]
-
-    if args.model_name == 'Gemini_2.0_Flash':
-        args.output_txt = '/metrics/results/Overall_gemini_2.0_flash_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_gemini_2.0_flash_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_gemini_2.0_flash_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_gemini_2.0_flash_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_gemini_2.0_flash_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_gemini_2.0_flash_eval.json',
-            '/eval_cot/IR/results/IR_gemini_2.0_flash_eval.json',
-            '/eval_cot/SA/results/SA_gemini_2.0_flash_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_gemini_2.0_flash_eval.json'
-        ]
-
-    if args.model_name == 'Gemini_2.5_Flash':
-        args.output_txt = '/metrics/results/Overall_gemini_2.5_flash_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_gemini_2.5_flash_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_gemini_2.5_flash_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_gemini_2.5_flash_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_gemini_2.5_flash_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_gemini_2.5_flash_eval.json',
-            '/eval_cot/IR/results/IR_gemini_2.5_flash_eval.json',
-            '/eval_cot/SA/results/SA_gemini_2.5_flash_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_gemini_2.5_flash_eval.json'
-        ]
-
-    if args.model_name == 'Gemini_2.5_Pro':
-        args.output_txt = '/metrics/results/Overall_gemini_2.5_pro_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_gemini_2.5_pro_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_gemini_2.5_pro_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_gemini_2.5_pro_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_gemini_2.5_pro_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_gemini_2.5_pro_eval.json',
-            '/eval_cot/IR/results/IR_gemini_2.5_pro_eval.json',
-            '/eval_cot/SA/results/SA_gemini_2.5_pro_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_gemini_2.5_pro_eval.json'
-        ]
-
-    if args.model_name == 'GPT-4.1':
-        args.output_txt = '/metrics/results/Overall_gpt4.1_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_gpt4.1_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_gpt4.1_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_gpt4.1_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_gpt4.1_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_gpt4.1_eval.json',
-            '/eval_cot/IR/results/IR_gpt4.1_eval.json',
-            '/eval_cot/SA/results/SA_gpt4.1_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_gpt4.1_eval.json'
-        ]
 
-    if args.model_name == 'GPT-4o':
-        args.output_txt = '/metrics/results/Overall_gpt4o_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_gpt4o_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_gpt4o_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_gpt4o_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_gpt4o_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_gpt4o_eval.json',
-            '/eval_cot/IR/results/IR_gpt4o_eval.json',
-            '/eval_cot/SA/results/SA_gpt4o_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_gpt4o_eval.json'
-        ]
-
-    if args.model_name == 'HumanOmni-7B':
-        args.output_txt = '/metrics/results/Overall_humanomni_7b_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_humanomni_7b_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_humanomni_7b_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_humanomni_7b_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_humanomni_7b_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_humanomni_7b_eval.json',
-            '/eval_cot/IR/results/IR_humanomni_7b_eval.json',
-            '/eval_cot/SA/results/SA_humanomni_7b_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_humanomni_7b_eval.json'
-        ]
-
-    if args.model_name == 'QVQ-72B':
-        args.output_txt = '/metrics/results/Overall_qvq_72b_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_qvq_72b_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_qvq_72b_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_qvq_72b_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_qvq_72b_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_qvq_72b_eval.json',
-            '/eval_cot/IR/results/IR_qvq_72b_eval.json',
-            '/eval_cot/SA/results/SA_qvq_72b_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_qvq_72b_eval.json'
-        ]
-
-    if args.model_name == 'Qwen2-Audio':
-        args.output_txt = '/metrics/results/Overall_qwen2_audio_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_qwen2_audio_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_qwen2_audio_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_qwen2_audio_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_qwen2_audio_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_qwen2_audio_eval.json',
-            '/eval_cot/IR/results/IR_qwen2_audio_eval.json',
-            '/eval_cot/SA/results/SA_qwen2_audio_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_qwen2_audio_eval.json'
-        ]
-
-    if args.model_name == 'Qwen2.5-Omni-7B':
-        args.output_txt = '/metrics/results/Overall_qwen2.5_omni_7b_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_qwen2.5_omni_7b_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_qwen2.5_omni_7b_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_qwen2.5_omni_7b_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_qwen2.5_omni_7b_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_qwen2.5_omni_7b_eval.json',
-            '/eval_cot/IR/results/IR_qwen2.5_omni_7b_eval.json',
-            '/eval_cot/SA/results/SA_qwen2.5_omni_7b_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_qwen2.5_omni_7b_eval.json'
-        ]
-
-    if args.model_name == 'Qwen2.5-VL-72B':
-        args.output_txt = '/metrics/results/Overall_qwen2.5vl_72b_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_qwen2.5vl_72b_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_qwen2.5vl_72b_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_qwen2.5vl_72b_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_qwen2.5vl_72b_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_qwen2.5vl_72b_eval.json',
-            '/eval_cot/IR/results/IR_qwen2.5vl_72b_eval.json',
-            '/eval_cot/SA/results/SA_qwen2.5vl_72b_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_qwen2.5vl_72b_eval.json'
-        ]
-
-    if args.model_name == 'Qwen2.5-VL-7B':
-        args.output_txt = '/metrics/results/Overall_qwen2.5vl_7b_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_qwen2.5vl_7b_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_qwen2.5vl_7b_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_qwen2.5vl_7b_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_qwen2.5vl_7b_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_qwen2.5vl_7b_eval.json',
-            '/eval_cot/IR/results/IR_qwen2.5vl_7b_eval.json',
-            '/eval_cot/SA/results/SA_qwen2.5vl_7b_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_qwen2.5vl_7b_eval.json'
-        ]
-
-    if args.model_name == 'Qwen2-VL-72B':
-        args.output_txt = '/metrics/results/Overall_qwen2vl_72b_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_qwen2vl_72b_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_qwen2vl_72b_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_qwen2vl_72b_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_qwen2vl_72b_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_qwen2vl_72b_eval.json',
-            '/eval_cot/IR/results/IR_qwen2vl_72b_eval.json',
-            '/eval_cot/SA/results/SA_qwen2vl_72b_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_qwen2vl_72b_eval.json'
-        ]
-
-    if args.model_name == 'Qwen2-VL-7B':
-        args.output_txt = '/metrics/results/Overall_qwen2vl_7b_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_qwen2vl_7b_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_qwen2vl_7b_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_qwen2vl_7b_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_qwen2vl_7b_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_qwen2vl_7b_eval.json',
-            '/eval_cot/IR/results/IR_qwen2vl_7b_eval.json',
-            '/eval_cot/SA/results/SA_qwen2vl_7b_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_qwen2vl_7b_eval.json'
-        ]
-
-    if args.model_name == 'R1-Omni-0.5B':
-        args.output_txt = '/metrics/results/Overall_r1_omni_0.5b_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_r1_omni_0.5b_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_r1_omni_0.5b_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_r1_omni_0.5b_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_r1_omni_0.5b_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_r1_omni_0.5b_eval.json',
-            '/eval_cot/IR/results/IR_r1_omni_0.5b_eval.json',
-            '/eval_cot/SA/results/SA_r1_omni_0.5b_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_r1_omni_0.5b_eval.json'
-        ]
-
-    if args.model_name == 'VideoLLaMA':
-        args.output_txt = '/metrics/results/Overall_VideoLLaMA_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_VideoLLaMA_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_VideoLLaMA_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_VideoLLaMA_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_VideoLLaMA_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_VideoLLaMA_eval.json',
-            '/eval_cot/IR/results/IR_VideoLLaMA_eval.json',
-            '/eval_cot/SA/results/SA_VideoLLaMA_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_VideoLLaMA_eval.json'
-        ]
-
-    if args.model_name == 'VideoLLaMA2':
-        args.output_txt = '/metrics/results/Overall_VideoLLaMA2_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_VideoLLaMA2_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_VideoLLaMA2_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_VideoLLaMA2_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_VideoLLaMA2_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_VideoLLaMA2_eval.json',
-            '/eval_cot/IR/results/IR_VideoLLaMA2_eval.json',
-            '/eval_cot/SA/results/SA_VideoLLaMA2_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_VideoLLaMA2_eval.json'
-        ]
+    args = parser.parse_args()
 
-    if args.model_name == 'VideoLLaVA':
-        args.output_txt = '/metrics/results/Overall_VideoLLaVA_metrics.txt'
-        file_paths = [
-            '/eval_cot/ER-Lab/results/ER_Lab_VideoLLaVA_eval.json',
-            '/eval_cot/ER-Wild/results/ER_SL_Wild_VideoLLaVA_eval.json',
-            '/eval_cot/ML-ER/results/ML_ER_VideoLLaVA_eval.json',
-            '/eval_cot/FG-ER/results/FG_ER_VideoLLaVA_eval.json',
-            '/eval_cot/Noise-ER/results/Noise_ER_VideoLLaVA_eval.json',
-            '/eval_cot/IR/results/IR_VideoLLaVA_eval.json',
-            '/eval_cot/SA/results/SA_VideoLLaVA_eval.json',
-            '/eval_cot/FG-SA/results/FG_SA_VideoLLaVA_eval.json'
-        ]       
 
-   
-    data = []
-    for path in file_paths:
-        with open(path, 'r') as f:
-            data.extend(json.load(f))
-    stats = process_data(data)
-    save_results(args, stats)
-    print(f"Metrics saved to {args.output_txt}")
+    if not 0 <= args.alpha <= 1:
+        raise ValueError("Lambda must be between 0 and 1")
+    if args.output_txt and not args.model_name:
+        raise ValueError("--output_txt needs --model_name")
+
+    inputs = load_manifest(args.manifest) if args.manifest else discover_results(args.results_root)
+    if args.model_name:
+        inputs = [item for item in inputs if item[1] == MODEL_NAMES.get(args.model_name, args.model_name)]
+    if not inputs:
+        raise FileNotFoundError(f"No results files found for the leaderboard under {args.results_root}")
+
+    models = sorted(set(model for _, model, _ in inputs))
+    for model in models:
+        missing = [task for task in TASK_FILE_PREFIXES if not any(item[:2] == (task, model) for item in inputs)]
+        if missing:
+            print(f"Warning: {model} has no results for {', '.join(missing)}, its Overall score covers fewer tasks")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    state = MetricsState(args.state_db or os.path.join(args.output_dir, "metrics_state.db"))
+    results = run_all(inputs, args.output_dir, args.alpha, overall=True, use_sidecar=not args.no_sidecar,
+                      workers=args.workers, state=state,
+                      bootstrap=args.bootstrap, seed=args.seed)
+    state.close()
+    print(f"Rescored {state.misses} of {state.hits + state.misses} file/task aggregates, reused the rest")
+    if args.output_txt:
+        save_results(args.output_txt, models[0], args.alpha, results[("Overall", models[0])], TASK)
+        print(f"Metrics saved to {args.output_txt}")
+
+    leaderboard_csv = write_leaderboard(results, args.output_dir, args.alpha)
+    print(f"\nLeaderboard of {len(models)} models saved to {leaderboard_csv}")
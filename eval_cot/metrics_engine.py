@@ -0,0 +1,722 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Score grammars: binary tasks rate every step 0/1 or 1/1, multi-label tasks rate the last step C/K
+BINARY_SCORE = re.compile(r': (\d)/1')
+FRACTION_SCORE = re.compile(r':\s*(\d+)/(\d+)')
+
+# Final-step parsing of the local recognition scorer
+STEP_BLOCK = re.compile(r'<step>(.*?)</step>', re.S)
+LAST_STEP = re.compile(r'Step\s*\d+\s*:((?:(?!Step\s*\d+\s*:).)*)$', re.S)
+PREDICTED = re.compile(r'predicted\s+\w+\s+(?:is|are|was|were)\s*:?\s*(.*)', re.I | re.S)
+LABEL_SPLIT = re.compile(r'\s*(?:,|;|/|\band\b|\bor\b)\s*')
+# A negation right before a label, allowing one word in between ("not very happy", "isn't happy")
+NEGATION = re.compile(r"(?:\b(?:not|no|never|without)|n't)\s+(?:\w+\s+)?$")
+
+# Synonym tables mapping label variants to one spelling; labels missing from a table match only themselves
+EMOTION_SYNONYMS = {
+    'anger': 'angry', 'mad': 'angry',
+    'happiness': 'happy', 'joy': 'happy', 'joyful': 'happy',
+    'sadness': 'sad', 'unhappy': 'sad',
+    'surprised': 'surprise', 'surprising': 'surprise',
+    'fearful': 'fear', 'scared': 'fear', 'afraid': 'fear',
+    'disgusted': 'disgust', 'disgusting': 'disgust',
+    'contemptuous': 'contempt',
+    'neutrality': 'neutral',
+    'worry': 'worried',
+    'excitement': 'excited'
+}
+SENTIMENT_SYNONYMS = {
+    'strong positive': 'positive', 'strongly positive': 'positive', 'weak positive': 'positive',
+    'weakly positive': 'positive', 'slightly positive': 'positive',
+    'strong negative': 'negative', 'strongly negative': 'negative', 'weak negative': 'negative',
+    'weakly negative': 'negative', 'slightly negative': 'negative'
+}
+FINE_SENTIMENT_SYNONYMS = {
+    'strongly positive': 'strong positive', 'very positive': 'strong positive',
+    'weakly positive': 'weak positive', 'slightly positive': 'weak positive',
+    'strongly negative': 'strong negative', 'very negative': 'strong negative',
+    'weakly negative': 'weak negative', 'slightly negative': 'weak negative'
+}
+INTENT_SYNONYMS = {
+    'question': 'questioning', 'agree': 'agreeing', 'agreement': 'agreeing',
+    'acknowledge': 'acknowledging', 'acknowledgement': 'acknowledging', 'acknowledgment': 'acknowledging',
+    'encourage': 'encouraging', 'encouragement': 'encouraging', 'console': 'consoling', 'consolation': 'consoling',
+    'suggest': 'suggesting', 'suggestion': 'suggesting', 'wish': 'wishing'
+}
+
+class TaskPlugin:
+    """Score grammar, label normalization and report layout of one task"""
+    def __init__(self, name, score_pattern=BINARY_SCORE, label_map=None, category_metrics=True, step_label="Avg Step",
+                 synonyms=None):
+        self.name = name
+        self.score_pattern = score_pattern
+        self.label_map = label_map or {}
+        self.category_metrics = category_metrics
+        self.step_label = step_label
+        self.synonyms = synonyms or {}
+        self.known_labels = set(self.synonyms) | set(self.synonyms.values())
+
+    def parse_ratings(self, score_str):
+        """Step ratings of a <score> block as (numerator, denominator) pairs, or None without one"""
+        match = re.search(r'<score>(.*?)</score>', score_str)
+        if not match:
+            return None
+        if self.score_pattern is BINARY_SCORE:
+            return [(int(m.group(1)), 1) for m in self.score_pattern.finditer(match.group(1))]
+        return [(int(m.group(1)), int(m.group(2))) for m in self.score_pattern.finditer(match.group(1))]
+
+    def normalize_label(self, label):
+        return self.label_map.get(label, label)
+
+    def signature(self):
+        """Changes whenever this plugin could sum the same results file differently"""
+        ident = json.dumps([SIDECAR_VERSION, METRICS_VERSION, self.name, self.score_pattern.pattern,
+                            self.label_map, self.category_metrics], sort_keys=True)
+        return hashlib.sha256(ident.encode('utf-8')).hexdigest()[:16]
+
+    def _split(self, text):
+        pieces = LABEL_SPLIT.split(text.lower()) if isinstance(text, str) else [str(item).lower() for item in text]
+        return [piece for piece in (piece.strip(" .'\"[]()*") for piece in pieces) if piece]
+
+    def truth_labels(self, ground_truth):
+        """Canonical ground-truth labels (string or list)"""
+        return {self.synonyms.get(piece, piece) for piece in self._split(ground_truth)}
+
+    def predicted_labels(self, text, truth=()):
+        """Canonical labels a prediction names, leaving out negated ones ("not happy")
+
+        Pieces naming no known or ground-truth label ("therefore", "as indicated by the smile")
+        are dropped when another piece names one, and kept as labels of their own otherwise.
+        """
+        # One alternation, longest first, so "strongly positive" wins over "positive" and
+        # "very strong negative" is not also read as "strong negative"
+        names = sorted(self.known_labels | set(truth), key=len, reverse=True)
+        pattern = re.compile(r'\b(?:' + '|'.join(map(re.escape, names)) + r')\b') if names else None
+        pieces = []
+        for piece in self._split(text):
+            # "a mix of happiness" names a label inside a longer phrase
+            matches = list(pattern.finditer(piece)) if pattern else []
+            labels = {self.synonyms.get(m.group(0), m.group(0)) for m in matches
+                      if not NEGATION.search(piece[:m.start()])}
+            pieces.append((piece, labels, bool(matches)))
+        if any(mentioned for _, _, mentioned in pieces):
+            return set().union(*(labels for _, labels, _ in pieces))
+        return {piece for piece, _, _ in pieces}
+
+    def rate_recognition(self, step, ground_truth):
+        """Local (C, K) rating of a step's final prediction, as the judge rates the last step
+
+        Binary tasks score 1/1 only for exactly the ground-truth label, multi-label tasks count
+        the predicted labels found in the ground truth over the number of ground-truth labels.
+        """
+        truth = self.truth_labels(ground_truth)
+        total = len(truth) if self.score_pattern is FRACTION_SCORE else 1
+        if not isinstance(step, str) or step.startswith("Error:"):
+            return 0, total
+        blocks = STEP_BLOCK.findall(step)
+        text = blocks[-1] if blocks else step
+        last = LAST_STEP.search(text)
+        text = last.group(1) if last else text
+        predicted = PREDICTED.search(text)
+        labels = self.predicted_labels(predicted.group(1) if predicted else text, truth)
+        if self.score_pattern is FRACTION_SCORE:
+            return len(labels & truth), total
+        return int(labels == truth), total
+
+TASKS = {
+    "ER-Lab": TaskPlugin("ER-Lab", synonyms=EMOTION_SYNONYMS),
+    "ER-Wild": TaskPlugin("ER-Wild", label_map={
+        'angry': 'anger',
+        'disgusted': 'disgust',
+        'happy': 'happiness',
+        'sad': 'sadness',
+        'surprised': 'surprise'
+    }, synonyms=EMOTION_SYNONYMS),
+    "FG-ER": TaskPlugin("FG-ER", FRACTION_SCORE, category_metrics=False, step_label="Avg Steps",
+                        synonyms=EMOTION_SYNONYMS),
+    "FG-SA": TaskPlugin("FG-SA", synonyms=FINE_SENTIMENT_SYNONYMS),
+    "IR": TaskPlugin("IR", synonyms=INTENT_SYNONYMS),
+    "ML-ER": TaskPlugin("ML-ER", FRACTION_SCORE, category_metrics=False, step_label="Avg Steps",
+                        synonyms=EMOTION_SYNONYMS),
+    "Noise-ER": TaskPlugin("Noise-ER", synonyms=EMOTION_SYNONYMS),
+    "SA": TaskPlugin("SA", synonyms=SENTIMENT_SYNONYMS),
+    # Pooled over every task's results, so it uses the grammar that accepts both rating styles
+    "Overall": TaskPlugin("Overall", FRACTION_SCORE, category_metrics=False, step_label="Avg Steps"),
+}
+
+def iter_records(path):
+    """Yield records one at a time from a JSON array file, or line by line from a .jsonl file"""
+    with open(path, 'r') as f:
+        if not path.endswith('.jsonl'):
+            yield from json.load(f)
+            return
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # Blank line, or the torn last line of an interrupted run
+                continue
+
+# Bump when the sidecar layout changes so stale sidecars are reparsed
+SIDECAR_VERSION = 1
+# Bump when the metric sums of unchanged ratings change, so MetricsState entries are recomputed
+METRICS_VERSION = 1
+
+class ScoreColumns:
+    """Parsed step ratings of a results file as flat arrays
+
+    The ratings of scored entry i are numerators/denominators[offsets[i]:offsets[i + 1]]
+    and its normalized ground truth label is labels[categories[i]].
+    Entries without a parsable rating are left out, as the metrics skip them.
+    """
+    def __init__(self, offsets, numerators, denominators, categories, labels):
+        self.offsets = offsets
+        self.numerators = numerators
+        self.denominators = denominators
+        self.categories = categories
+        self.labels = labels
+
+    @classmethod
+    def concatenate(cls, columns):
+        """Pool several files' columns, merging their label vocabularies"""
+        labels = sorted(set(label for column in columns for label in column.labels))
+        codes = {label: code for code, label in enumerate(labels)}
+        offsets = [np.zeros(1, dtype=np.int64)]
+        shift = 0
+        for column in columns:
+            offsets.append(column.offsets[1:] + shift)
+            shift += len(column.numerators)
+        return cls(
+            np.concatenate(offsets),
+            np.concatenate([column.numerators for column in columns] + [np.zeros(0, dtype=np.int32)]),
+            np.concatenate([column.denominators for column in columns] + [np.zeros(0, dtype=np.int32)]),
+            np.concatenate([
+                np.array([codes[label] for label in column.labels], dtype=np.int32)[column.categories]
+                for column in columns if len(column.categories)
+            ] + [np.zeros(0, dtype=np.int32)]),
+            labels
+        )
+
+    def entry_scores(self):
+        """Per-entry recognition score, reasoning score and step count
+
+        The last step is the recognition score, the mean of the earlier steps the reasoning score.
+        """
+        if len(self.offsets) < 2:
+            return np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64)
+        values = np.divide(self.numerators, self.denominators, out=np.zeros(len(self.numerators)),
+                           where=self.denominators > 0)
+        starts = self.offsets[:-1]
+        ends = self.offsets[1:]
+        steps = ends - starts
+        acc = values[ends - 1]
+        values[ends - 1] = 0.0
+        reason = np.add.reduceat(values, starts) / np.maximum(steps - 1, 1)
+        return acc, reason, steps
+
+    def stats(self):
+        """Summed metrics, overall and per category"""
+        acc, reason, steps = self.entry_scores()
+        sums = {
+            'acc': np.bincount(self.categories, weights=acc, minlength=len(self.labels)),
+            'reason': np.bincount(self.categories, weights=reason, minlength=len(self.labels)),
+            'count': np.bincount(self.categories, minlength=len(self.labels)),
+            'step': np.bincount(self.categories, weights=steps, minlength=len(self.labels))
+        }
+        return {
+            'total': {'acc': float(acc.sum()), 'reason': float(reason.sum()), 'count': len(acc), 'step': int(steps.sum())},
+            'categories': {
+                label: {
+                    'acc': float(sums['acc'][code]),
+                    'reason': float(sums['reason'][code]),
+                    'count': int(sums['count'][code]),
+                    'step': int(sums['step'][code])
+                }
+                for code, label in enumerate(self.labels) if sums['count'][code]
+            }
+        }
+
+    def save(self, path, source_stat, plugin):
+        with open(f"{path}.tmp", 'wb') as f:
+            np.savez(
+                f,
+                version=SIDECAR_VERSION,
+                signature=plugin.signature(),
+                source_size=source_stat.st_size,
+                source_mtime_ns=source_stat.st_mtime_ns,
+                offsets=self.offsets,
+                numerators=self.numerators,
+                denominators=self.denominators,
+                categories=self.categories,
+                labels=np.array(self.labels, dtype=str)
+            )
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, path, source_stat, plugin):
+        """Columns from a sidecar, or None if it is missing, older than its results file or was
+        parsed by a different version of the task plugin"""
+        try:
+            with np.load(path) as data:
+                if (int(data['version']) != SIDECAR_VERSION
+                        or str(data['signature']) != plugin.signature()
+                        or int(data['source_size']) != source_stat.st_size
+                        or int(data['source_mtime_ns']) != source_stat.st_mtime_ns):
+                    return None
+                return cls(data['offsets'], data['numerators'], data['denominators'], data['categories'],
+                           data['labels'].tolist())
+        except (OSError, KeyError, ValueError):
+            return None
+
+class ColumnBuilder:
+    """Accumulates parsed ratings of one task plugin into ScoreColumns"""
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self.offsets = [0]
+        self.numerators = []
+        self.denominators = []
+        self.categories = []
+        self.codes = {}
+
+    def add(self, entry):
+        ratings = self.plugin.parse_ratings(str(entry['score']))
+        if not ratings:
+            return
+        for numerator, denominator in ratings:
+            self.numerators.append(numerator)
+            self.denominators.append(denominator)
+        self.offsets.append(len(self.numerators))
+        label = self.plugin.normalize_label(entry['ground_truth'])
+        self.categories.append(self.codes.setdefault(label, len(self.codes)))
+
+    def build(self):
+        return ScoreColumns(
+            np.array(self.offsets, dtype=np.int64),
+            np.array(self.numerators, dtype=np.int32),
+            np.array(self.denominators, dtype=np.int32),
+            np.array(self.categories, dtype=np.int32),
+            list(self.codes)
+        )
+
+def sidecar_path(path, plugin):
+    return f"{path}.{plugin.name}.npz"
+
+def load_columns(path, plugins, use_sidecar=True):
+    """ScoreColumns of a results file for each plugin
+
+    Columns come from the .npz sidecars next to the file when they are current; the others are
+    parsed in a single pass over the records and written back as sidecars.
+    """
+    source_stat = os.stat(path)
+    columns = {}
+    if use_sidecar:
+        for plugin in plugins:
+            cached = ScoreColumns.load(sidecar_path(path, plugin), source_stat, plugin)
+            if cached is not None:
+                columns[plugin.name] = cached
+
+    builders = [ColumnBuilder(plugin) for plugin in plugins if plugin.name not in columns]
+    if builders:
+        for entry in iter_records(path):
+            for builder in builders:
+                builder.add(entry)
+        for builder in builders:
+            columns[builder.plugin.name] = builder.build()
+            if use_sidecar:
+                try:
+                    columns[builder.plugin.name].save(sidecar_path(path, builder.plugin), source_stat, builder.plugin)
+                except OSError as e:
+                    print(f"Warning: could not write score sidecar for {path}: {e}")
+    return [columns[plugin.name] for plugin in plugins]
+
+def load_pooled_columns(paths, plugin, use_sidecar=True):
+    """Per-item scores of several results files, concatenated under one task plugin"""
+    return ScoreColumns.concatenate([load_columns(path, [plugin], use_sidecar)[0] for path in paths])
+
+def _bootstrap_means(values, resamples, rng, chunk_bytes):
+    """Column means of `resamples` bootstrap resamples of the rows of values, drawn chunk by chunk"""
+    n = len(values)
+    unique, inverse = np.unique(values, axis=0, return_inverse=True)
+    means = np.empty((resamples, values.shape[1]))
+    if len(unique) * 4 < n:
+        # Scores take few distinct values, so drawing n rows with replacement is a multinomial
+        # draw of how often each distinct row recurs: a (chunk, distinct rows) count matrix
+        frequencies = np.bincount(inverse.reshape(-1), minlength=len(unique)) / n
+        rows = max(1, chunk_bytes // (len(unique) * 8))
+        for start in range(0, resamples, rows):
+            stop = min(start + rows, resamples)
+            means[start:stop] = rng.multinomial(n, frequencies, size=stop - start) @ unique / n
+    else:
+        rows = max(1, chunk_bytes // (n * (4 + values.itemsize * values.shape[1])))
+        for start in range(0, resamples, rows):
+            stop = min(start + rows, resamples)
+            index = rng.integers(0, n, size=(stop - start, n), dtype=np.int32)
+            means[start:stop] = values[index].mean(axis=1)
+    return means
+
+def bootstrap_ci(columns, alpha, resamples, seed=0, confidence=0.95, chunk_bytes=64 * 1024 ** 2):
+    """Percentile bootstrap CIs of the Recognition, Reasoning and CoT scores, overall and per category
+
+    Items are resampled within the whole set and within each category; intervals are (low, high) pairs.
+    """
+    acc, reason, _ = columns.entry_scores()
+    values = np.column_stack([acc, reason])
+    rng = np.random.default_rng(seed)
+    bounds = [50 * (1 - confidence), 50 * (1 + confidence)]
+
+    def interval(rows):
+        means = _bootstrap_means(rows, resamples, rng, chunk_bytes)
+        cot = alpha * means[:, 0] + (1 - alpha) * means[:, 1]
+        low, high = np.percentile(np.column_stack([means, cot]), bounds, axis=0)
+        return {name: (float(low[i]), float(high[i])) for i, name in enumerate(('acc', 'reason', 'cot'))}
+
+    return {
+        'confidence': confidence,
+        'resamples': resamples,
+        'total': interval(values) if len(values) else None,
+        'categories': {
+            label: interval(values[columns.categories == code])
+            for code, label in enumerate(columns.labels) if np.any(columns.categories == code)
+        }
+    }
+
+def bootstrap_files(paths, plugin, alpha, resamples, seed=0, use_sidecar=True):
+    """Bootstrap CIs of one or more results files pooled under a task plugin"""
+    return bootstrap_ci(load_pooled_columns(paths, plugin, use_sidecar), alpha, resamples, seed)
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 ** 2), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def new_stats():
+    return {'total': {'acc': 0, 'reason': 0, 'count': 0, 'step': 0}, 'categories': {}}
+
+def merge_stats(stats_list):
+    """Add up per-file metric sums; categories are merged by label"""
+    merged = new_stats()
+    for stats in stats_list:
+        for key in merged['total']:
+            merged['total'][key] += stats['total'][key]
+        for label, bucket in stats['categories'].items():
+            target = merged['categories'].setdefault(label, {'acc': 0, 'reason': 0, 'count': 0, 'step': 0})
+            for key in target:
+                target[key] += bucket[key]
+    return merged
+
+class MetricsState:
+    """Per-file metric sums in SQLite, reused while a results file's fingerprint is unchanged
+
+    A file is unchanged if its size and mtime match; when only the mtime moved (touched or
+    copied files) the content hash decides. Sums are also dropped when the task plugin's
+    signature (grammar, label map, versions) no longer matches the one they were made with.
+    """
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(file_stats)")]
+        if columns and "signature" not in columns:
+            # Store from before plugin signatures, its sums cannot be trusted
+            with self.conn:
+                self.conn.execute("DROP TABLE file_stats")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS file_stats ("
+            "path TEXT, task TEXT, signature TEXT, size INTEGER, mtime_ns INTEGER, sha256 TEXT, stats TEXT, "
+            "PRIMARY KEY (path, task))"
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, task, source_stat):
+        path = os.path.abspath(path)
+        row = self.conn.execute(
+            "SELECT signature, size, mtime_ns, sha256, stats FROM file_stats WHERE path = ? AND task = ?", (path, task)
+        ).fetchone()
+        if row is None or row[0] != TASKS[task].signature() or row[1] != source_stat.st_size:
+            self.misses += 1
+            return None
+        if row[2] != source_stat.st_mtime_ns:
+            if file_sha256(path) != row[3]:
+                self.misses += 1
+                return None
+            with self.conn:
+                self.conn.execute("UPDATE file_stats SET mtime_ns = ? WHERE path = ? AND task = ?",
+                                  (source_stat.st_mtime_ns, path, task))
+        self.hits += 1
+        return json.loads(row[4])
+
+    def put(self, path, task, source_stat, sha256, stats):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO file_stats VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(path), task, TASKS[task].signature(), source_stat.st_size, source_stat.st_mtime_ns,
+                 sha256, json.dumps(stats))
+            )
+
+    def close(self):
+        self.conn.close()
+
+def _file_stats(path, task_names, use_sidecar, with_hash):
+    """Metric sums of one results file for each task plugin (run in worker processes)"""
+    source_stat = os.stat(path)
+    plugins = [TASKS[name] for name in task_names]
+    stats = [columns.stats() for columns in load_columns(path, plugins, use_sidecar)]
+    return source_stat, file_sha256(path) if with_hash else None, stats
+
+def collect_stats(items, use_sidecar=True, state=None, workers=1):
+    """Metric sums for each (path, task names) item, recomputing only files the state store lacks"""
+    results = [None] * len(items)
+    pending = []
+    for index, (path, task_names) in enumerate(items):
+        if state is not None:
+            source_stat = os.stat(path)
+            cached = [state.get(path, name, source_stat) for name in task_names]
+            if all(stats is not None for stats in cached):
+                results[index] = cached
+                continue
+        pending.append(index)
+
+    args = [[items[index][0] for index in pending], [items[index][1] for index in pending],
+            [use_sidecar] * len(pending), [state is not None] * len(pending)]
+    if workers > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            computed = list(executor.map(_file_stats, *args))
+    else:
+        computed = list(map(_file_stats, *args))
+
+    for index, (source_stat, sha256, stats) in zip(pending, computed):
+        results[index] = stats
+        if state is not None:
+            path, task_names = items[index]
+            for name, task_stats in zip(task_names, stats):
+                state.put(path, name, source_stat, sha256, task_stats)
+    return results
+
+def process_files(paths, plugin, use_sidecar=True, state=None, workers=1):
+    """Metrics of one or more results files pooled under a task plugin"""
+    stats = collect_stats([(path, [plugin.name]) for path in paths], use_sidecar, state, workers)
+    return merge_stats(file_stats[0] for file_stats in stats)
+
+def process_data(input_file, plugin, use_sidecar=True, state=None):
+    return process_files([input_file], plugin, use_sidecar, state)
+
+def format_ci(ci, bucket_ci, metric):
+    """' (95% CI lo-hi)' suffix for a report line, or '' without bootstrap"""
+    if not bucket_ci:
+        return ""
+    low, high = bucket_ci[metric]
+    return f" ({100*ci['confidence']:.0f}% CI {100*low:.1f}-{100*high:.1f})"
+
+def summarize(bucket, alpha):
+    """Averages of an accumulated bucket as (recognition, reasoning, combined, steps)"""
+    count = bucket['count']
+    avg_acc = bucket['acc'] / count if count else 0
+    avg_reason = bucket['reason'] / count if count else 0
+    avg_step = bucket['step'] / count if count else 0
+    return avg_acc, avg_reason, alpha * avg_acc + (1 - alpha) * avg_reason, avg_step
+
+def save_results(output_txt, model_name, alpha, stats, plugin):
+    """Write the metrics report; scores carry their CI when stats holds a 'ci' from bootstrap_ci"""
+    total = stats['total']
+    avg_acc, avg_reason, combined_score, avg_step = summarize(total, alpha)
+    ci = stats.get('ci')
+    total_ci = ci and ci['total']
+
+    with open(output_txt, 'w') as f:
+        f.write(f"Model: {model_name}\n")
+        f.write(f"Alpha: {alpha:.1f}\n\n")
+
+        f.write("=== Overall Metrics ===\n")
+        f.write(f"Total Count: {total['count']}\n")
+        f.write(f"Recognition Score: {100*avg_acc:.1f}{format_ci(ci, total_ci, 'acc')}\n")
+        f.write(f"Reasoning Score: {100*avg_reason:.1f}{format_ci(ci, total_ci, 'reason')}\n")
+        f.write(f"CoT Score: {100*combined_score:.1f}{format_ci(ci, total_ci, 'cot')}\n")
+        f.write(f"{plugin.step_label}: {avg_step:.1f}\n\n")
+
+        if not plugin.category_metrics:
+            return
+        f.write("=== Category Metrics ===\n")
+        for cat in sorted(stats['categories']):
+            cat_acc, cat_reason, cat_score, cat_step = summarize(stats['categories'][cat], alpha)
+            cat_ci = ci and ci['categories'].get(cat)
+
+            f.write(f"Category: {cat}\n")
+            f.write(f"  Recognition Score: {100*cat_acc:.1f}{format_ci(ci, cat_ci, 'acc')}\n")
+            f.write(f"  Reasoning Score: {100*cat_reason:.1f}{format_ci(ci, cat_ci, 'reason')}\n")
+            f.write(f"  CoT Score: {100*cat_score:.1f}{format_ci(ci, cat_ci, 'cot')}\n")
+            f.write(f"  {plugin.step_label}: {cat_step:.1f}\n")
+            f.write("-"*40 + "\n")
+
+def recognition_file(path, plugin):
+    """Summed local recognition ratings and entry count of a step or results file"""
+    total = 0.0
+    count = 0
+    for entry in iter_records(path):
+        numerator, denominator = plugin.rate_recognition(entry.get('step'), entry['ground_truth'])
+        total += numerator / denominator if denominator else 0.0
+        count += 1
+    return total, count
+
+def recognition_preview(inputs, output_dir, overall=False, workers=1):
+    """Recognition Scores of every (task, model, path) input from the final steps alone
+
+    Needs only extracted steps and ground truths, no frames and no judge, so a preview
+    leaderboard is ready before the CoT judge run. Writes recognition_preview.csv and
+    returns {(task, model): (score, count)}.
+    """
+    for task, _, _ in inputs:
+        if task not in TASKS or task == "Overall":
+            raise ValueError(f"Unknown task '{task}', expected one of: {', '.join(t for t in TASKS if t != 'Overall')}")
+
+    paths = [path for _, _, path in inputs]
+    plugins = [TASKS[task] for task, _, _ in inputs]
+    if workers > 1 and len(inputs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            sums = list(executor.map(recognition_file, paths, plugins))
+    else:
+        sums = list(map(recognition_file, paths, plugins))
+
+    pooled = {}
+    for (task, model, _), (total, count) in zip(inputs, sums):
+        for key in [(task, model), ("Overall", model)] if overall else [(task, model)]:
+            previous = pooled.get(key, (0.0, 0))
+            pooled[key] = (previous[0] + total, previous[1] + count)
+    results = {key: (total / count if count else 0.0, count) for key, (total, count) in pooled.items()}
+
+    tasks = list(dict.fromkeys((["Overall"] if overall else []) + [task for task, _, _ in inputs]))
+    models = sorted(set(model for _, model in results),
+                    key=lambda model: results.get((tasks[0], model), (0.0, 0))[0], reverse=True)
+    os.makedirs(output_dir, exist_ok=True)
+    preview_csv = os.path.join(output_dir, "recognition_preview.csv")
+    with open(preview_csv, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Model"] + [f"{task} {metric}" for task in tasks for metric in ("Recognition", "Count")])
+        for model in models:
+            row = [model]
+            for task in tasks:
+                score, count = results.get((task, model), (None, None))
+                row.extend(["", ""] if score is None else [f"{100*score:.1f}", count])
+            writer.writerow(row)
+
+    print(f"{'Model':<18}" + "".join(f"{task:>10}" for task in tasks) + "   (Recognition Score, no judge)")
+    for model in models:
+        cells = [f"{100*results[(task, model)][0]:>10.1f}" if (task, model) in results else f"{'-':>10}"
+                 for task in tasks]
+        print(f"{model:<18}" + "".join(cells))
+    return results
+
+def load_manifest(path):
+    """(task, model, path) inputs from a JSON list of {"task", "model", "path"} objects"""
+    with open(path, 'r') as f:
+        return [(item["task"], item["model"], item["path"]) for item in json.load(f)]
+
+def run_all(inputs, output_dir, alpha=0.5, overall=False, use_sidecar=True, workers=1, state=None,
+            bootstrap=0, seed=0):
+    """Score every (task, model, path) input, parsing each file at most once
+
+    With overall=True the records of each model are also pooled into an Overall report,
+    rescored with the Overall grammar in the same pass. With workers > 1 the files are
+    loaded in a process pool, and with a MetricsState only changed files are loaded at all.
+    With bootstrap > 0 every report also gets CIs from that many resamples (stats['ci']).
+    Returns {(task, model): stats}.
+    """
+    for task, _, _ in inputs:
+        if task not in TASKS:
+            raise ValueError(f"Unknown task '{task}', expected one of: {', '.join(TASKS)}")
+
+    items = [(path, [task, "Overall"] if overall else [task]) for task, _, path in inputs]
+    pooled = {}
+    for (_, model, _), (_, task_names), stats in zip(inputs, items, collect_stats(items, use_sidecar, state, workers)):
+        for name, task_stats in zip(task_names, stats):
+            pooled.setdefault((name, model), []).append(task_stats)
+    results = {key: merge_stats(stats) for key, stats in pooled.items()}
+
+    if bootstrap:
+        # Resampling needs the per-item scores, which come from the .npz sidecars
+        paths = {}
+        for (_, model, path), (_, task_names) in zip(inputs, items):
+            for name in task_names:
+                paths.setdefault((name, model), []).append(path)
+        keys = list(results)
+        args = [[paths[key] for key in keys], [TASKS[key[0]] for key in keys], [alpha] * len(keys),
+                [bootstrap] * len(keys), [seed] * len(keys), [use_sidecar] * len(keys)]
+        if workers > 1 and len(keys) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                intervals = list(executor.map(bootstrap_files, *args))
+        else:
+            intervals = list(map(bootstrap_files, *args))
+        for key, ci in zip(keys, intervals):
+            results[key]['ci'] = ci
+
+    os.makedirs(output_dir, exist_ok=True)
+    summary = []
+    for (task, model), stats in results.items():
+        output_txt = os.path.join(output_dir, f"{task}_{model}_metrics.txt")
+        save_results(output_txt, model, alpha, stats, TASKS[task])
+        avg_acc, avg_reason, combined_score, avg_step = summarize(stats['total'], alpha)
+        entry = {
+            "task": task,
+            "model": model,
+            "count": stats['total']['count'],
+            "recognition": 100 * avg_acc,
+            "reasoning": 100 * avg_reason,
+            "cot": 100 * combined_score,
+            "steps": avg_step
+        }
+        if 'ci' in stats:
+            entry["ci"] = stats['ci']
+        summary.append(entry)
+    with open(os.path.join(output_dir, "summary.json"), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Emotion Analysis Metrics Calculator for several tasks and models at once")
+    parser.add_argument("--input", type=str, nargs=3, action="append", default=[], metavar=("TASK", "MODEL", "PATH"),
+                        help="One evaluated results file (JSON or JSONL); repeat for every task/model")
+    parser.add_argument("--manifest", type=str, default='',
+                        help="JSON list of {\"task\", \"model\", \"path\"} objects, in addition to --input")
+    parser.add_argument("--output_dir", type=str, default='', help="Directory for the metrics files and summary.json")
+    parser.add_argument("--overall", action="store_true", help="Also pool each model's results into an Overall report")
+    parser.add_argument("--no_sidecar", action="store_true",
+                        help="Always parse the results files instead of reading/writing .npz score sidecars")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes loading results files")
+    parser.add_argument("--state_db", type=str, default='',
+                        help="SQLite store of per-file metric sums, so only changed files are rescored "
+                             "(default: <output_dir>/metrics_state.db)")
+    parser.add_argument("--bootstrap", type=int, default=0, help="Bootstrap resamples for CIs (0 = point estimates only)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the bootstrap resampling")
+    parser.add_argument("--recognition_only", action="store_true",
+                        help="Preview Recognition Scores from the final steps of step or results files, without the judge")
+    parser.add_argument("--alpha", type=float, default=0.5, help="Weighting factor", metavar="[0.0-1.0]")
+
+    args = parser.parse_args()
+
+    if not 0 <= args.alpha <= 1:
+        raise ValueError("Lambda must be between 0 and 1")
+
+    inputs = [tuple(item) for item in args.input]
+    if args.manifest:
+        inputs.extend(load_manifest(args.manifest))
+
+    if args.recognition_only:
+        results = recognition_preview(inputs, args.output_dir, args.overall, args.workers)
+        print(f"\nRecognition preview of {len(results)} task/model pairs saved to "
+              f"{os.path.join(args.output_dir, 'recognition_preview.csv')}")
+    else:
+        os.makedirs(args.output_dir, exist_ok=True)
+        state = MetricsState(args.state_db or os.path.join(args.output_dir, "metrics_state.db"))
+        results = run_all(inputs, args.output_dir, args.alpha, args.overall, not args.no_sidecar, args.workers, state,
+                          args.bootstrap, args.seed)
+        state.close()
+        print(f"Rescored {state.misses} of {state.hits + state.misses} file/task aggregates, reused the rest")
+        print(f"Metrics for {len(results)} task/model pairs saved to {args.output_dir}")
@@ -0,0 +1,49 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from metrics_engine import TASKS
+
+
+@pytest.mark.parametrize("step, expected", [
+    ("<step>Step 1: She smiles. Step 2: The predicted emotion is happy, as indicated by the smile.</step>", (1, 1)),
+    ("<step>Step 1: She smiles. Step 2: Therefore, the person feels happy.</step>", (1, 1)),
+    ("<step>Step 1: The predicted emotion is happiness.</step>", (1, 1)),
+    ("<step>Step 1: The predicted emotion is a mix of happiness and surprise.</step>", (0, 1)),
+    ("<step>Step 1: The predicted emotion is not happy.</step>", (0, 1)),
+    ("<step>Step 1: The predicted emotion isn't really happy.</step>", (0, 1)),
+    ("<step>Step 1: The predicted emotion is contemplative.</step>", (0, 1)),
+    ("<step>Step 1: The predicted emotion is None.</step>", (0, 1)),
+    ("Error: request failed", (0, 1)),
+])
+def test_binary_final_step(step, expected):
+    assert TASKS["ER-Lab"].rate_recognition(step, "happy") == expected
+
+
+def test_negated_label_next_to_prediction():
+    step = "<step>Step 1: The predicted emotion is sad, not happy.</step>"
+    assert TASKS["ER-Lab"].rate_recognition(step, "sad") == (1, 1)
+
+
+def test_synonyms_per_task():
+    assert TASKS["ER-Wild"].rate_recognition("<step>Step 1: The predicted emotion is anger.</step>", "angry") == (1, 1)
+    assert TASKS["FG-SA"].rate_recognition(
+        "<step>Step 1: The predicted sentiment is strongly positive.</step>", "strong positive") == (1, 1)
+    assert TASKS["SA"].rate_recognition("<step>Step 1: The predicted sentiment is weak positive.</step>", "positive") == (1, 1)
+    assert TASKS["IR"].rate_recognition("<step>Step 1: The predicted intent is question.</step>", "questioning") == (1, 1)
+
+
+def test_multi_label_counts_matches_over_truth():
+    step = "<step>Step 1: The predicted emotions are happy,disgust,sad.</step>"
+    assert TASKS["ML-ER"].rate_recognition(step, "sad,anger,surprise,disgust") == (2, 4)
+    step = "<step>Step 1: The predicted emotions are Anticipation, Fear and Happy.</step>"
+    assert TASKS["FG-ER"].rate_recognition(step, ["Anticipation", "Fear", "Peace"]) == (2, 3)
+
+
+def test_longest_label_wins_over_nested_label():
+    step = "<step>Step 1: The predicted sentiment is very strong negative.</step>"
+    assert TASKS["FG-SA"].rate_recognition(step, "very strong negative") == (1, 1)
+    step = "<step>Step 1: The predicted sentiment is strong negative.</step>"
+    assert TASKS["FG-SA"].rate_recognition(step, "very strong negative") == (0, 1)
@@ -0,0 +1,33 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import metrics_engine
+from metrics_engine import EMOTION_SYNONYMS, TaskPlugin, load_columns, sidecar_path
+
+
+def write_results(path):
+    with open(path, 'w') as f:
+        json.dump([
+            {"score": "<score>Step 1: 1/1</score>", "ground_truth": "happy"},
+            {"score": "<score>Step 1: 0/1</score>", "ground_truth": "sad"},
+        ], f)
+
+
+def test_sidecar_reused_for_same_plugin(tmp_path, monkeypatch):
+    path = str(tmp_path / "results.json")
+    write_results(path)
+    load_columns(path, [TaskPlugin("ER-Lab", synonyms=EMOTION_SYNONYMS)])
+    assert os.path.exists(sidecar_path(path, TaskPlugin("ER-Lab")))
+    monkeypatch.setattr(metrics_engine, "iter_records", None)
+    assert load_columns(path, [TaskPlugin("ER-Lab", synonyms=EMOTION_SYNONYMS)])[0].labels == ["happy", "sad"]
+
+
+def test_sidecar_reparsed_when_plugin_changes(tmp_path):
+    path = str(tmp_path / "results.json")
+    write_results(path)
+    assert load_columns(path, [TaskPlugin("ER-Lab", synonyms=EMOTION_SYNONYMS)])[0].labels == ["happy", "sad"]
+    changed = TaskPlugin("ER-Lab", label_map={"happy": "happiness"}, synonyms=EMOTION_SYNONYMS)
+    assert load_columns(path, [changed])[0].labels == ["happiness", "sad"]
+    assert load_columns(path, [changed], use_sidecar=False)[0].labels == ["happiness", "sad"]
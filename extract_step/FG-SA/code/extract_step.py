@@ -1,12 +1,110 @@
 import argparse
+import hashlib
 import json
 import time
 import os
+import random
+import re
+import threading
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from openai import OpenAI
 from tqdm import tqdm
 
-def process_entry(model, client, entry):
-    messages = [
+# Completion tokens reserved per request until the provider reports usage
+COMPLETION_TOKEN_ESTIMATE = 300
+
+# Bare answers from this vocabulary (plus each entry's label_set and ground truth) and refusals are
+# turned into steps locally, exactly like the examples in the extraction prompt
+STEP_SUBJECT = "sentiment"
+MULTI_LABEL = False
+LABELS = (
+    "strong positive", "positive", "weak positive", "neutral", "weak negative", "negative", "strong negative"
+)
+ANSWER_PREFIX = re.compile(r"^(?:the\s+)?(?:predicted\s+)?(?:emotions?|sentiment|intent|answer|label)\s*(?::|is\b|are\b)\s*")
+LABEL_SEPARATOR = re.compile(r"\s*(?:,|;|/|\band\b)\s*")
+# Only short answers with an explicit refusal phrase count as refusals, anything else goes to the extractor
+REFUSAL_MAX_CHARS = 200
+REFUSAL_PATTERN = re.compile(
+    r"\b(?:cannot|can't|can not|unable to|not able to)\s+"
+    r"(?:provide|determine|analy[sz]e|identify|assess|tell|access|view|see|watch|process|help)\b"
+)
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute token buckets shared by all workers (0 = unlimited)"""
+    def __init__(self, rpm=0, tpm=0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.lock = threading.Lock()
+        self.request_allowance = float(rpm)
+        self.token_allowance = float(tpm)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        if self.rpm:
+            self.request_allowance = min(self.rpm, self.request_allowance + elapsed * self.rpm / 60)
+        if self.tpm:
+            self.token_allowance = min(self.tpm, self.token_allowance + elapsed * self.tpm / 60)
+
+    def acquire(self, tokens=0):
+        """Block until one request and `tokens` tokens fit in the budgets"""
+        tokens = min(tokens, self.tpm)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait_time = self.blocked_until - now
+                if wait_time <= 0:
+                    waits = [0.0]
+                    if self.rpm and self.request_allowance < 1:
+                        waits.append((1 - self.request_allowance) * 60 / self.rpm)
+                    if self.tpm and self.token_allowance < tokens:
+                        waits.append((tokens - self.token_allowance) * 60 / self.tpm)
+                    wait_time = max(waits)
+                    if wait_time == 0:
+                        if self.rpm:
+                            self.request_allowance -= 1
+                        if self.tpm:
+                            self.token_allowance -= tokens
+                        return
+            time.sleep(wait_time)
+
+    def record_usage(self, reserved_tokens, used_tokens):
+        """Settle a reservation against the usage the provider actually reported"""
+        if self.tpm:
+            with self.lock:
+                self.token_allowance += min(reserved_tokens, self.tpm) - used_tokens
+
+    def pause(self, seconds):
+        """Hold back every worker, e.g. when the provider sends Retry-After"""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+def parse_retry_after(response):
+    """Seconds requested by a Retry-After header (delta-seconds or HTTP-date), or None"""
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, base_delay, max_delay=60):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+def build_messages(entry):
+    return [
         {
             "role": "system",
             "content": "You are an expert in affective computing and very good at handling tasks related to emotion recognition."
@@ -42,8 +140,52 @@ def process_entry(model, client, entry):
         }
     ]
 
+def split_labels(value):
+    if isinstance(value, str):
+        value = LABEL_SEPARATOR.split(value.lower())
+    return [label.strip() for label in value or [] if isinstance(label, str) and label.strip()]
+
+def rule_based_step(entry):
+    """The step of a label-only or refusal answer, or None if the answer needs the extraction model"""
+    answer = entry.get('model_response')
+    if not isinstance(answer, str):
+        return None
+    answer = " ".join(answer.lower().replace("\u2019", "'").split()).strip("\"'`*.!")
+    vocabulary = set(LABELS)
+    vocabulary.update(split_labels(entry.get('label_set')))
+    vocabulary.update(split_labels(entry.get('ground_truth')))
+
+    labels = [label for label in LABEL_SEPARATOR.split(ANSWER_PREFIX.sub("", answer)) if label]
+    if labels and all(label in vocabulary for label in labels):
+        if len(labels) == 1:
+            return f"<step>Step 1: The predicted {STEP_SUBJECT} is {labels[0]}.</step>"
+        if MULTI_LABEL:
+            return f"<step>Step 1: The predicted {STEP_SUBJECT}s are {', '.join(labels[:-1])} and {labels[-1]}.</step>"
+        return None
+
+    if len(answer) <= REFUSAL_MAX_CHARS and REFUSAL_PATTERN.search(answer) and not any(
+        re.search(rf"\b{re.escape(label)}\b", answer) for label in vocabulary
+    ):
+        return f"<step>Step 1: The predicted {STEP_SUBJECT} is None.</step>"
+    return None
+
+# Changes with the extraction prompt, so responses are only grouped under the same prompt
+PROMPT_VERSION = hashlib.sha256(json.dumps(build_messages({'model_response': ''})).encode('utf-8')).hexdigest()[:16]
+
+def dedup_key(entry):
+    """Entries whose responses match up to case and whitespace share one extraction"""
+    response = " ".join(str(entry['model_response']).split()).casefold()
+    return hashlib.sha256(f"{PROMPT_VERSION}\n{response}".encode('utf-8')).hexdigest()
+
+def process_entry(model, client, entry, rate_limiter=None):
+    messages = build_messages(entry)
+
     max_retries = 10
+    rate_limiter = rate_limiter or RateLimiter()
+    reserved_tokens = len(messages[0]["content"] + messages[1]["content"]) // 4 + COMPLETION_TOKEN_ESTIMATE
     for attempt in range(max_retries):
+        rate_limiter.acquire(reserved_tokens)
+        used_tokens = 0
         try:
             response = client.chat.completions.create(
                 model=model,
@@ -51,54 +193,279 @@ def process_entry(model, client, entry):
                 temperature=0.0,
                 timeout=120
             )
+            if response.usage is not None:
+                used_tokens = response.usage.total_tokens
             result = response.choices[0].message.content
             entry['step'] = result
             return True
 
         except Exception as e:
             if attempt < max_retries - 1:
-                time.sleep(2)
+                retry_after = parse_retry_after(getattr(e, "response", None))
+                if retry_after is not None:
+                    # The provider asked every worker to back off, not just this request
+                    rate_limiter.pause(retry_after)
+                    time.sleep(retry_after)
+                else:
+                    time.sleep(backoff_delay(attempt, 2))
             else:
                 entry['step'] = f"Error: {str(e)}"
                 return False
+        finally:
+            rate_limiter.record_usage(reserved_tokens, used_tokens)
     return False
 
-def process_json_file(input_file, output_file, model_name, api_key, base_url):
+def iter_records(path):
+    """Yield the records of a JSON array file, or stream them line by line from a .jsonl file"""
+    with open(path, 'r') as f:
+        if not path.endswith('.jsonl'):
+            yield from json.load(f)
+            return
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # Blank line, or the torn last line of an interrupted run
+                continue
+
+def write_records(path, records):
+    """Atomically write records as a JSON array, or one per line if path ends with .jsonl"""
+    with open(f"{path}.tmp", 'w') as f:
+        if path.endswith('.jsonl'):
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        else:
+            json.dump(list(records), f, indent=2, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+
+class JsonlWriter:
+    """Append JSONL records, flushing each one to the OS and fsyncing every few records or seconds"""
+    def __init__(self, path, sync_every=64, sync_interval=5.0):
+        self.file = open(path, 'a')
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # A crashed process then loses no finished record, only an OS crash can lose the unsynced tail
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+def has_step(entry):
+    step = entry.get('step')
+    return isinstance(step, str) and not step.startswith("Error:")
+
+def load_finished_steps(paths):
+    """Map video_id to a successfully extracted step from earlier (partial) outputs"""
+    steps = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        for record in iter_records(path):
+            if has_step(record):
+                steps[record['video_id']] = record['step']
+    return steps
+
+def process_json_file(input_file, output_file, model_name, api_key, base_url, workers=1, resume=False,
+                      rpm=0, tpm=0, rules=True, dedup=True):
     
-    with open(input_file, 'r') as f:
-        data = json.load(f)
+    data = list(iter_records(input_file))
 
     #data = data[:10]
 
-    client = OpenAI(api_key=api_key, base_url=base_url)
+    # Retries are paced by the shared rate limiter below instead of the client's own retry loop
+    client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+    rate_limiter = RateLimiter(rpm, tpm)
+
+    ruled = set()
+    for entry in data:
+        step = rule_based_step(entry) if rules else None
+        if 'label_set' in entry:
+            del entry['label_set']
+        if step is not None:
+            entry['step'] = step
+            ruled.add(id(entry))
+
+    # A .jsonl output is streamed as entries finish (in completion order) and is its own checkpoint
+    streamed = output_file.endswith('.jsonl')
+    checkpoint_path = output_file if streamed else f"{output_file}.ckpt.jsonl"
+    if not resume and os.path.exists(checkpoint_path) and os.path.getsize(checkpoint_path) > 0:
+        # Starting over would truncate extracted (and paid for) records
+        raise FileExistsError(f"Checkpoint {checkpoint_path} already holds extracted records; "
+                              f"pass --resume to continue it, or remove it to start over")
+    if resume:
+        finished = load_finished_steps([output_file] if streamed else [output_file, checkpoint_path])
+        for entry in data:
+            if not has_step(entry) and entry['video_id'] in finished:
+                entry['step'] = finished[entry['video_id']]
+        pending = [entry for entry in data if not has_step(entry)]
+        print(f"Resuming: {len(data) - len(pending)} already extracted, {len(pending)} remaining")
+    else:
+        pending = [entry for entry in data if id(entry) not in ruled]
+    if ruled:
+        print(f"Rule-based steps for {len(ruled)} label-only or refusal answers, no extraction call needed")
+
+    # Start the checkpoint over with the entries that are already done
+    pending_ids = set(map(id, pending))
+    write_records(checkpoint_path, (entry for entry in data if id(entry) not in pending_ids))
+
+    # One extraction per distinct response, copied to every entry that gave the same answer
+    groups = {}
+    for entry in pending:
+        groups.setdefault(dedup_key(entry) if dedup else id(entry), []).append(entry)
 
+    def extract(group):
+        success = process_entry(model_name, client, group[0], rate_limiter)
+        for entry in group[1:]:
+            entry['step'] = group[0]['step']
+        return success
+
+    # Entries are updated in place, so the output keeps the input order
     success_count = 0
-    for entry in tqdm(data, desc="Processing entries"):
+    checkpoint = JsonlWriter(checkpoint_path)
+    try:
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            futures = {executor.submit(extract, group): group for group in groups.values()}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Processing entries"):
+                group = futures.pop(future)
+                if future.result():
+                    success_count += len(group)
+                for entry in group:
+                    checkpoint.write(entry)
+    finally:
+        checkpoint.close()
+
+    if not streamed:
+        write_records(output_file, data)
+
+    print(f"\nProcessing completed. Success: {success_count}/{len(pending)} "
+          f"(skipped {len(data) - len(pending)} already extracted or rule-based)")
+    if pending:
+        print(f"Deduplication: {len(groups)} extraction calls for {len(pending)} entries "
+              f"(dedup ratio {1 - len(groups) / len(pending):.1%})")
+
+def write_batch_requests(input_file, model_name, batch_dir, rules=True, dedup=True):
+    """Write Batch API input JSONL with one chat completion request per entry (custom_id = video_id)
+
+    Entries answered by rule_based_step get no request, and with dedup entries with the same response
+    share one request (custom_id = dedup_key); ingest fills them all in again.
+    """
+    os.makedirs(batch_dir, exist_ok=True)
+    batch_path = os.path.join(batch_dir, "batch_requests.jsonl")
+    written = 0
+    entries = 0
+    seen = set()
+    with open(batch_path, 'w') as f:
+        for entry in iter_records(input_file):
+            if rules and rule_based_step(entry) is not None:
+                continue
+            entries += 1
+            custom_id = dedup_key(entry) if dedup else entry['video_id']
+            if custom_id in seen:
+                continue
+            seen.add(custom_id)
+            f.write(json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {"model": model_name, "messages": build_messages(entry), "temperature": 0.0}
+            }, ensure_ascii=False) + "\n")
+            written += 1
 
+    print(f"\nWrote {written} batch requests for {entries} entries to {batch_path}")
+    if entries:
+        print(f"Deduplication ratio: {1 - written / entries:.1%}")
+
+def ingest_batch_outputs(input_file, output_file, batch_dir, rules=True):
+    """Fill in 'step' from Batch API output files (*output*.jsonl in batch_dir)"""
+    data = list(iter_records(input_file))
+
+    responses = {}
+    for name in sorted(os.listdir(batch_dir)):
+        if "output" not in name or not name.endswith(".jsonl"):
+            continue
+        with open(os.path.join(batch_dir, name), 'r') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    responses[record["custom_id"]] = record
+
+    success_count = 0
+    for entry in data:
+        step = rule_based_step(entry) if rules else None
         if 'label_set' in entry:
             del entry['label_set']
-        if process_entry(model_name, client, entry):
+        record = responses.get(entry['video_id']) or responses.get(dedup_key(entry)) or {}
+        response = record.get("response") or {}
+        body = response.get("body") or {}
+        if step is not None and not record:
+            entry['step'] = step
+            success_count += 1
+        elif response.get("status_code") == 200 and body.get("choices"):
+            entry['step'] = body["choices"][0]["message"]["content"]
             success_count += 1
+        else:
+            error = record.get("error") or body.get("error") or "missing from batch output"
+            entry['step'] = f"Error: {error}"
 
-    with open(output_file, 'w') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    write_records(output_file, data)
 
-    print(f"\nProcessing completed. Success: {success_count}/{len(data)}")
+    print(f"\nBatch ingest completed. Success: {success_count}/{len(data)}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process emotion recognition results with GPT-4")
-    parser.add_argument("--input_json", type=str, default='', help="Input JSON file path")
-    parser.add_argument("--output_json", type=str, default='', help="Input JSON file path")
+    parser.add_argument("--input_json", type=str, default='', help="Input JSON (or JSONL) file path")
+    parser.add_argument("--output_json", type=str, default='',
+                        help="Output JSON file path (.jsonl: stream entries as they finish)")
     parser.add_argument("--model", type=str, default='gpt-4.1-2025-04-14', help="OpenAI model name")
     parser.add_argument("--api_key", type=str, default='', help="OpenAI API key")
     parser.add_argument("--base_url", type=str, default='', help="API base URL")
+    parser.add_argument("--workers", type=int, default=1, help="Maximum number of concurrent completions")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests-per-minute budget (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=0, help="Tokens-per-minute budget (0 = unlimited)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip entries already extracted in the output or its .ckpt.jsonl checkpoint")
+    parser.add_argument("--batch_mode", type=str, default='', choices=['', 'write', 'ingest'],
+                        help="write: dump Batch API request JSONL; ingest: build the output from Batch API output JSONL")
+    parser.add_argument("--batch_dir", type=str, default='', help="Directory holding batch request/output JSONL files")
+    parser.add_argument("--no_rules", action="store_true",
+                        help="Send label-only and refusal answers to the extraction model too")
+    parser.add_argument("--no_dedup", action="store_true",
+                        help="Extract every entry separately, even when responses are identical")
     
     args = parser.parse_args()
 
-    process_json_file(
-        input_file=args.input_json,
-        output_file=args.output_json,
-        model_name=args.model,
-        api_key=args.api_key,
-        base_url=args.base_url
-    )
\ No newline at end of file
+    if args.batch_mode and not args.batch_dir:
+        raise ValueError("--batch_mode requires --batch_dir")
+    if args.batch_mode == 'write':
+        write_batch_requests(args.input_json, args.model, args.batch_dir, not args.no_rules, not args.no_dedup)
+    elif args.batch_mode == 'ingest':
+        ingest_batch_outputs(args.input_json, args.output_json, args.batch_dir, not args.no_rules)
+    else:
+        process_json_file(
+            input_file=args.input_json,
+            output_file=args.output_json,
+            model_name=args.model,
+            api_key=args.api_key,
+            base_url=args.base_url,
+            workers=args.workers,
+            resume=args.resume,
+            rpm=args.rpm,
+            tpm=args.tpm,
+            rules=not args.no_rules,
+            dedup=not args.no_dedup
+        )
\ No newline at end of file